@@ -0,0 +1,138 @@
+# generates many episodes in one process, querying upcoming episodes while earlier ones are synthesized
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import json
+import logging
+import os
+import threading
+import time
+
+# one line of the jobs file
+BatchJob = namedtuple('BatchJob', ['episodeNumber', 'prompt', 'acts'])
+
+class BatchRunner:
+
+    DEFAULT_EPISODES_AT_ONCE = 2 # episodes queried at the same time, each also queries its acts concurrently
+    DEFAULT_ACTS = 1
+    STATUS_QUERIED = 'queried'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_PRODUCE_FAILED = 'produce_failed' # queried but synthesis failed, the episode data is reused on the next run
+
+    def __init__(self, generator, episodesAtOnce=DEFAULT_EPISODES_AT_ONCE):
+        self.generator = generator # shared by every job so the tokenizer, voice model and synthesis pool load once
+        self.episodesAtOnce = max(1, episodesAtOnce)
+        self.manifest = {}
+        self.manifestFilename = None
+        self.manifestLock = threading.Lock()
+
+    def manifest_filename(self, jobsFilename):
+        return os.path.splitext(jobsFilename)[0] + '.status.json'
+
+    def load_jobs(self, filename):
+        # one json object per line, {"episodeNumber": 1, "prompt": "...", "acts": 2}
+        jobs = []
+        with open(filename, 'r') as f:
+            for lineNumber, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                    jobs.append(BatchJob(int(entry['episodeNumber']), entry['prompt'], int(entry.get('acts', self.DEFAULT_ACTS))))
+                except (ValueError, KeyError, TypeError) as e:
+                    raise ValueError('Invalid job on line {0} of {1}: {2}'.format(lineNumber, filename, e))
+        episodeNumbers = [x.episodeNumber for x in jobs]
+        if len(set(episodeNumbers)) != len(episodeNumbers):
+            raise ValueError('Episode numbers in {0} must be unique, each job writes to its own episode folder'.format(filename))
+        return jobs
+
+    def load_manifest(self, filename):
+        self.manifestFilename = filename
+        if os.path.exists(filename):
+            with open(filename, 'r') as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = {}
+
+    def save_manifest(self):
+        # written to a temporary file first so a killed batch never leaves a half written manifest
+        tmpFilename = '{0}.{1}.tmp'.format(self.manifestFilename, os.getpid())
+        with open(tmpFilename, 'w') as f:
+            json.dump(self.manifest, f, indent=4)
+        os.replace(tmpFilename, self.manifestFilename)
+
+    def job_status(self, job):
+        # a job only keeps its status while its prompt and acts are unchanged
+        entry = self.manifest.get(str(job.episodeNumber))
+        if entry is None or entry['prompt'] != job.prompt or entry['acts'] != job.acts:
+            return None
+        return entry['status']
+
+    def set_status(self, job, status, error=None):
+        with self.manifestLock:
+            entry = {
+                'prompt' : job.prompt,
+                'acts' : job.acts,
+                'status' : status,
+                'updated' : time.strftime('%Y-%m-%dT%H:%M:%S')
+            }
+            if error is not None:
+                entry['error'] = str(error)
+            self.manifest[str(job.episodeNumber)] = entry
+            self.save_manifest()
+
+    def query_job(self, job, outputFolder):
+        # runs on a query thread, returns the episode data or None if the job failed
+        episodeDataFilename = '{0}/episodeData.json'.format(outputFolder)
+        if self.job_status(job) in (self.STATUS_QUERIED, self.STATUS_PRODUCE_FAILED) and os.path.exists(episodeDataFilename):
+            logging.info('Episode {0} was already queried, reusing its episode data'.format(job.episodeNumber))
+            return self.generator.load_data(episodeDataFilename)
+        try:
+            episodeData = self.generator.query_episode(job.prompt, outputFolder, numberOfActs=job.acts)
+        except Exception as e:
+            logging.error('Failed to query episode {0}: {1}'.format(job.episodeNumber, e))
+            self.set_status(job, self.STATUS_FAILED, e)
+            return None
+        self.set_status(job, self.STATUS_QUERIED)
+        return episodeData
+
+    def run(self, jobsFilename, episodeFolder, manifestFilename=None):
+        # returns (done, failed) job counts, jobs already done in an earlier run are skipped
+        jobs = self.load_jobs(jobsFilename)
+        self.load_manifest(manifestFilename or self.manifest_filename(jobsFilename))
+        pendingJobs = [x for x in jobs if self.job_status(x) != self.STATUS_DONE]
+        logging.info('Generating {0} episodes ({1} already done)'.format(len(pendingJobs), len(jobs) - len(pendingJobs)))
+        # queries run ahead on their own threads while finished episodes are synthesized here,
+        # so the network wait of later episodes overlaps the speech synthesis of earlier ones
+        with ThreadPoolExecutor(max_workers=self.episodesAtOnce) as executor:
+            futures = {executor.submit(self.query_job, x, episodeFolder.format(x.episodeNumber)) : x for x in pendingJobs}
+            try:
+                done, failed = self.produce_queried(futures, episodeFolder, len(pendingJobs))
+            finally:
+                # queries that have not started are dropped if the batch is stopped, the manifest resumes them
+                for future in futures:
+                    future.cancel()
+        return done, failed
+
+    def produce_queried(self, futures, episodeFolder, jobCount):
+        # synthesizes each episode as soon as its queries finish, whatever order they finish in
+        done = 0
+        failed = 0
+        for future in as_completed(futures):
+            job = futures[future]
+            episodeData = future.result()
+            if episodeData is None:
+                failed += 1
+                continue
+            try:
+                self.generator.produce_episode(episodeData, episodeFolder.format(job.episodeNumber))
+            except Exception as e:
+                logging.error('Failed to generate audio for episode {0}: {1}'.format(job.episodeNumber, e))
+                self.set_status(job, self.STATUS_PRODUCE_FAILED, e)
+                failed += 1
+                continue
+            self.set_status(job, self.STATUS_DONE)
+            done += 1
+            logging.info('Episode {0} done ({1}/{2})'.format(job.episodeNumber, done + failed, jobCount))
+        return done, failed
@@ -0,0 +1,195 @@
+# line-delimited episode corpus shared by the scraper and trainer
+
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import textwrap
+import time
+
+class EpisodeCorpus:
+
+    # one {"episodeNumber": X, "episode": {...}} entry per line, appended as episodes are scraped
+    FILENAME = '../episodes.jsonl'
+    FOLLOW_POLL_INTERVAL = 1 # seconds between checks for new lines while following
+    FOLLOW_IDLE_TIMEOUT = 300 # seconds without new lines before following stops
+    EPISODE_NUMBER_PATTERN = re.compile(rb'^\{"episodeNumber": (\d+)')
+    EPISODE_LINK_PATTERN = re.compile(r'/(\d+)/')
+
+    def __init__(self, filename=FILENAME):
+        self.filename = filename
+
+    def format_entry(self, episodeNumber, episodeData):
+        return json.dumps({'episodeNumber' : episodeNumber, 'episode' : episodeData}) + '\n'
+
+    def entry_digest(self, line):
+        return hashlib.blake2b(line, digest_size=16).digest()
+
+    def append(self, f, episodeNumber, episodeData, latestDigests=None):
+        # f is a file opened with open_for_append, flushed per entry so readers see whole episodes
+        # with latestDigests (from entry_digests) an episode identical to its latest entry is not written again
+        entry = self.format_entry(episodeNumber, episodeData)
+        if latestDigests is not None and latestDigests.get(episodeNumber) == self.entry_digest(entry.encode('utf-8')):
+            return False
+        f.write(entry)
+        f.flush()
+        return True
+
+    def open_for_append(self):
+        directory = os.path.dirname(self.filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.drop_incomplete_entry()
+        return open(self.filename, 'a')
+
+    def drop_incomplete_entry(self):
+        # a killed scrape can leave half a line at the end, which new entries must not be appended onto
+        if not os.path.exists(self.filename):
+            return
+        with open(self.filename, 'rb+') as f:
+            f.seek(0, os.SEEK_END)
+            end = f.tell()
+            position = end
+            while position > 0:
+                readSize = min(4096, position)
+                f.seek(position - readSize)
+                chunk = f.read(readSize)
+                newline = chunk.rfind(b'\n')
+                if newline != -1:
+                    position = position - readSize + newline + 1
+                    break
+                position -= readSize
+            if position != end:
+                logging.warning('Dropping incomplete last entry in {0}'.format(self.filename))
+                f.truncate(position)
+
+    def records(self, follow=False, pollInterval=FOLLOW_POLL_INTERVAL, idleTimeout=FOLLOW_IDLE_TIMEOUT):
+        # yields (episodeNumber, episodeData) in file order, one line in memory at a time
+        # with follow the file is tailed, so a trainer can start while a scrape is still appending
+        idleSince = time.monotonic()
+        while follow and not os.path.exists(self.filename):
+            if time.monotonic() - idleSince > idleTimeout:
+                return
+            time.sleep(pollInterval)
+        with open(self.filename, 'rb') as f:
+            while True:
+                position = f.tell()
+                line = f.readline()
+                if line.endswith(b'\n'):
+                    idleSince = time.monotonic()
+                    record = self.parse_line(line)
+                    if record is not None:
+                        yield record
+                    continue
+                if not follow:
+                    if line:
+                        logging.warning('Skipping incomplete last entry in {0}'.format(self.filename))
+                    return
+                # nothing new (or a partly written line), wait for the writer
+                if time.monotonic() - idleSince > idleTimeout:
+                    return
+                f.seek(position)
+                time.sleep(pollInterval)
+
+    def parse_line(self, line):
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            logging.warning('Skipping unreadable entry in {0}'.format(self.filename))
+            return None
+        return entry['episodeNumber'], entry['episode']
+
+    def index(self):
+        # episodeNumber -> byte offset of its latest entry, without decoding any episode
+        offsets = {}
+        if not os.path.exists(self.filename):
+            return offsets
+        with open(self.filename, 'rb') as f:
+            position = 0
+            for line in f:
+                match = self.EPISODE_NUMBER_PATTERN.match(line)
+                if match and line.endswith(b'\n'):
+                    offsets[int(match.group(1))] = position
+                position += len(line)
+        return offsets
+
+    def entry_digests(self):
+        # episodeNumber -> digest of its latest entry, lets a refresh skip episodes that did not change
+        digests = {}
+        if not os.path.exists(self.filename):
+            return digests
+        with open(self.filename, 'rb') as f:
+            for line in f:
+                match = self.EPISODE_NUMBER_PATTERN.match(line)
+                if match and line.endswith(b'\n'):
+                    digests[int(match.group(1))] = self.entry_digest(line)
+        return digests
+
+    def episode_numbers(self):
+        return set(self.index().keys())
+
+    def episodes(self, follow=False):
+        # without follow, episodes come back in episode order with re-scraped episodes only once
+        if follow:
+            for _, episodeData in self.records(follow=True):
+                yield episodeData
+            return
+        for _, episodeData in self.latest_records():
+            yield episodeData
+
+    def latest_records(self, skip=()):
+        # (episodeNumber, episodeData) of the latest entry of each episode in episode order, episodes in skip are never decoded
+        offsets = self.index()
+        episodeNumbers = sorted(x for x in offsets.keys() if x not in skip)
+        if not episodeNumbers:
+            return
+        with open(self.filename, 'rb') as f:
+            for episodeNumber in episodeNumbers:
+                f.seek(offsets[episodeNumber])
+                record = self.parse_line(f.readline())
+                if record is not None:
+                    yield record
+
+    def export_json(self, filename):
+        # writes the same indented array the scraper used to write, one episode in memory at a time
+        with open(filename, 'w') as f:
+            f.write('[')
+            first = True
+            for episodeData in self.episodes():
+                f.write('\n' if first else ',\n')
+                f.write(textwrap.indent(json.dumps(episodeData, indent=4), '    '))
+                first = False
+            f.write(']' if first else '\n]')
+
+    def convert_from_json(self, jsonFilename, replace=False):
+        # imports an episodes.json written by older versions of the scraper, returns the number of episodes written
+        # an existing corpus is kept and only gets the episodes it is missing, unless replace is set
+        with open(jsonFilename, 'r') as f:
+            scraperData = json.load(f)
+        existingEpisodes = set() if replace else self.episode_numbers()
+        directory = os.path.dirname(self.filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # written to a temporary file first so a failed convert never leaves a truncated corpus
+        tmpFilename = '{0}.{1}.tmp'.format(self.filename, os.getpid())
+        keepExisting = not replace and os.path.exists(self.filename)
+        if keepExisting:
+            self.drop_incomplete_entry()
+            shutil.copyfile(self.filename, tmpFilename)
+        written = 0
+        with open(tmpFilename, 'a' if keepExisting else 'w') as f:
+            for i, episodeData in enumerate(scraperData):
+                episodeNumber = self.episode_number_from_data(episodeData, i + 1)
+                if episodeNumber in existingEpisodes:
+                    continue
+                self.append(f, episodeNumber, episodeData)
+                written += 1
+        os.replace(tmpFilename, self.filename)
+        return written
+
+    def episode_number_from_data(self, episodeData, default):
+        # episode links look like /1/new-beginnings, fall back to the position in the file
+        match = self.EPISODE_LINK_PATTERN.search(episodeData.get('episodeLinkName', ''))
+        return int(match.group(1)) if match else default
@@ -0,0 +1,83 @@
+# finds near-duplicate acts (credits, reruns, sponsor reads) with minhash signatures and an lsh index
+
+import logging
+import re
+import zlib
+
+class NearDuplicateFilter:
+
+    DEFAULT_THRESHOLD = 0.8 # estimated jaccard similarity of shingles at which two acts count as duplicates
+    NUM_PERMUTATIONS = 128
+    SHINGLE_SIZE = 5 # words per shingle
+    MERSENNE_PRIME = (1 << 31) - 1
+    SEED = 1
+    WORD_PATTERN = re.compile(r'\w+')
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, numPermutations=NUM_PERMUTATIONS):
+        self.threshold = threshold
+        self.numPermutations = numPermutations
+        import numpy as np # only loaded once a filter is in use, keeps the cli quick to start
+        generator = np.random.RandomState(self.SEED)
+        self.permutationA = generator.randint(1, self.MERSENNE_PRIME, size=(numPermutations, 1)).astype(np.uint64)
+        self.permutationB = generator.randint(0, self.MERSENNE_PRIME, size=(numPermutations, 1)).astype(np.uint64)
+        self.bands, self.rows = self.lsh_parameters(threshold, numPermutations)
+        self.buckets = [{} for _ in range(self.bands)] # band -> band hash -> keys
+        self.signatures = {} # key -> signature of every kept text
+        self.duplicates = 0
+        logging.debug('Near-duplicate filter using {0} bands of {1} rows for threshold {2}'.format(self.bands, self.rows, threshold))
+
+    def lsh_parameters(self, threshold, numPermutations):
+        # bands/rows whose s-curve crosses 50% closest to the threshold, roughly (1/bands)^(1/rows)
+        best = None
+        for rows in range(1, numPermutations + 1):
+            bands = numPermutations // rows
+            error = abs((1.0 / bands) ** (1.0 / rows) - threshold)
+            if best is None or error < best[0]:
+                best = (error, bands, rows)
+        return best[1], best[2]
+
+    def shingles(self, text):
+        words = self.WORD_PATTERN.findall(text.lower())
+        if not words:
+            return None
+        import numpy as np
+        grams = [' '.join(words[i:i + self.SHINGLE_SIZE]) for i in range(max(1, len(words) - self.SHINGLE_SIZE + 1))]
+        return np.unique(np.array([zlib.crc32(x.encode('utf-8')) for x in grams], dtype=np.uint64) % self.MERSENNE_PRIME)
+
+    def signature(self, text):
+        shingleHashes = self.shingles(text)
+        if shingleHashes is None:
+            return None
+        # every permutation applied to every shingle at once, then the min per permutation
+        return ((self.permutationA * shingleHashes + self.permutationB) % self.MERSENNE_PRIME).min(axis=1).astype('uint32')
+
+    def band_keys(self, signature):
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def find_duplicate(self, signature, bandKeys):
+        import numpy as np
+        checked = set()
+        for band, bandKey in enumerate(bandKeys):
+            for candidate in self.buckets[band].get(bandKey, []):
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+                if np.mean(self.signatures[candidate] == signature) >= self.threshold:
+                    return candidate
+        return None
+
+    def is_duplicate(self, key, text):
+        # the first text seen is kept, anything later that is too similar to it is a duplicate
+        signature = self.signature(text)
+        if signature is None:
+            return False
+        bandKeys = self.band_keys(signature)
+        duplicateOf = self.find_duplicate(signature, bandKeys)
+        if duplicateOf is not None:
+            self.duplicates += 1
+            logging.debug('{0} is a near-duplicate of {1}'.format(key, duplicateOf))
+            return True
+        self.signatures[key] = signature
+        for band, bandKey in enumerate(bandKeys):
+            self.buckets[band].setdefault(bandKey, []).append(key)
+        return False
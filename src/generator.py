@@ -1,14 +1,54 @@
 # generates a complete script and audio file
 # Created by Michael Kukar in 2023
 
-import openai
+# openai, TTS and numpy are imported where they are used, they take seconds to load and most actions never need them
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import hashlib
+import multiprocessing
 import json
 import logging
 import os
-from TTS.api import TTS
+import queue
+import random
+import time
 
+from lexicon import PronunciationLexicon
+from metrics import Metrics
+import script
 from tamtrainer import TAMTrainer
 
+workerTTS = None # one voice model per synthesis process, loaded by init_tts_worker
+
+def init_tts_worker(voiceModel):
+    global workerTTS
+    import torch
+    torch.set_num_threads(1) # one core per worker, the pool provides the parallelism
+    workerTTS = load_tts(voiceModel)
+
+def load_tts(voiceModel):
+    from TTS.api import TTS
+    return TTS(voiceModel)
+
+def synthesize_in_worker(text, speakerVoice):
+    return synthesize(workerTTS, text, speakerVoice)
+
+def voices_in_worker():
+    return voice_list(workerTTS)
+
+def voice_list(tts):
+    # (speakers, sample rate), all the main process needs of the voice model when the workers synthesize
+    return list(tts.speakers), tts.synthesizer.output_sample_rate
+
+def synthesize(tts, text, speakerVoice):
+    # vits samples noise, seeding it from the utterance makes serial and parallel synthesis produce the same audio
+    try:
+        import torch
+    except ImportError:
+        return tts.tts(text, speaker=speakerVoice) # torch comes with TTS, only a stand-in voice model runs without it
+    torch.manual_seed(int(hashlib.sha256('{0}\0{1}'.format(speakerVoice, text).encode('utf-8')).hexdigest()[:8], 16))
+    return tts.tts(text, speaker=speakerVoice)
+
 class Generator:
 
     VOICE_MODEL = 'tts_models/en/vctk/vits'
@@ -31,25 +71,121 @@ class Generator:
     ]
 
     EPISODE_FOLDER = '../episodes/episode {0}'
+    VOICES_FILENAME = '{0}/voices.json' # speaker -> voice of an episode, reused when it is generated again
+    DEFAULT_QUERY_WORKERS = 4
+    MAX_QUERY_RETRIES = 5
+    RETRY_BACKOFF = 2 # seconds, doubled on every retry
+    DEFAULT_TTS_WORKERS = 1
+    DEFAULT_SPEAKER_SILENCE = 0 # seconds of silence added when the speaker changes
+    TTS_QUEUE_PER_WORKER = 4 # utterances in flight per synthesis process, bounds memory held by finished audio
+    DEFAULT_RETRIEVAL_RESULTS = 0 # similar scraped summaries added to each prompt, 0 leaves prompts as the model was trained on
+    MAX_RETRIEVAL_TOKENS = 256 # the added summaries are cut to this so the completion keeps most of the token limit
 
-    def __init__(self, apiKey, modelId):
-        openai.api_key = apiKey
-        self.trainer = TAMTrainer()
+    def __init__(self, apiKey, modelId, queryWorkers=DEFAULT_QUERY_WORKERS, apiBase=None, ttsCache=None, ttsWorkers=DEFAULT_TTS_WORKERS, speakerSilence=DEFAULT_SPEAKER_SILENCE, tts=None, metrics=None, lexicon=None, retrievalIndex=None, retrievalResults=DEFAULT_RETRIEVAL_RESULTS, newVoices=False):
+        self.apiKey = apiKey
+        self.apiBase = apiBase
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.trainer = TAMTrainer(metrics=self.metrics)
         self.modelId = modelId
-    
-    def query_episode_data(self, summaryPrompt, numberOfActs=1):
-        episodeData = []
-        acts = ['prologue', 'credits']
-        acts[1:1] = ['act ' + str(x) for x in range(1, numberOfActs+1)]
-        for act in acts:
-            episodeData.append(self.run_query(self.build_prompt(summaryPrompt, act)))
+        self.queryWorkers = max(1, queryWorkers)
+        self.ttsCache = ttsCache # UtteranceCache, or None to always synthesize
+        self.ttsWorkers = max(1, ttsWorkers)
+        self.ttsPool = None
+        self.speakerSilence = speakerSilence
+        self.synthesizedUtterances = 0 # lines the voice model synthesized, cache hits are not counted
+        self.synthesizedSamples = 0
+        self.lexicon = lexicon if lexicon is not None else PronunciationLexicon(self.PRONUNCIATION_FIXES)
+        self.tts = tts # voice model used in this process, VOICE_MODEL is loaded on first use when not given
+        self.voices = None # (speakers, sample rate) of the voice model
+        self.retrievalIndex = retrievalIndex # EpisodeIndex of scraped summaries, or None to use the prompt as given
+        self.retrievalResults = retrievalResults
+        self.newVoices = newVoices # True assigns new random voices instead of reusing an episode's saved ones
+
+    def openai(self):
+        # the openai module configured for this generator
+        import openai
+        openai.api_key = self.apiKey
+        if self.apiBase is not None:
+            openai.api_base = self.apiBase
+        return openai
+
+    def retry_errors(self):
+        openai = self.openai()
+        return (
+            openai.error.RateLimitError,
+            openai.error.APIError,
+            openai.error.APIConnectionError,
+            openai.error.ServiceUnavailableError,
+            openai.error.Timeout
+        )
+
+    def load_tts(self):
+        # the voice model is loaded the first time audio is made and then kept for the rest of the run
+        if self.tts is None:
+            with self.metrics.span('tts_load'):
+                self.tts = load_tts(self.VOICE_MODEL)
+        return self.tts
+
+    def load_voices(self):
+        # with synthesis processes, a worker reports the voices so this process never loads a model of its own
+        if self.voices is None:
+            if self.tts is not None or self.ttsWorkers == 1:
+                self.voices = voice_list(self.load_tts())
+            else:
+                with self.metrics.span('tts_load'): # the worker loads its model first
+                    self.voices = self.tts_pool().submit(voices_in_worker).result()
+        return self.voices
+
+    def query_episode_data(self, summaryPrompt, numberOfActs=1, completedQueries=None):
+        # completedQueries maps prompt -> response, it is filled in as acts finish so a failed run keeps what it paid for
+        completedQueries = {} if completedQueries is None else completedQueries
+        prompts = self.build_episode_prompts(summaryPrompt, numberOfActs)
+        pendingPrompts = [x for x in prompts if x not in completedQueries]
+        errors = []
+        with ThreadPoolExecutor(max_workers=self.queryWorkers) as executor:
+            futures = {executor.submit(self.run_query_with_retry, x) : x for x in pendingPrompts}
+            for future in as_completed(futures):
+                try:
+                    completedQueries[futures[future]] = future.result()
+                except Exception as e:
+                    errors.append(e)
+        if errors:
+            raise errors[0]
+        episodeData = [completedQueries[x] for x in prompts]
         episodeData.append(self.add_postcredits(summaryPrompt))
         return episodeData
 
+    def episode_act_names(self, numberOfActs):
+        acts = ['prologue', 'credits']
+        acts[1:1] = ['act ' + str(x) for x in range(1, numberOfActs+1)]
+        return acts
+
+    def run_query_with_retry(self, prompt):
+        # only this act is retried, the rest of the episode keeps running
+        retryErrors = self.retry_errors()
+        for attempt in range(self.MAX_QUERY_RETRIES + 1):
+            try:
+                return self.run_query(prompt)
+            except retryErrors as e:
+                if attempt == self.MAX_QUERY_RETRIES:
+                    raise
+                delay = self.retry_delay(attempt, e)
+                logging.warning('Query failed ({0}), retrying in {1:.1f} seconds...'.format(e, delay))
+                self.metrics.count('completion.retries')
+                time.sleep(delay)
+
+    def retry_delay(self, attempt, error):
+        # rate limit errors can say how long to wait, otherwise backs off exponentially with jitter
+        retryAfter = (getattr(error, 'headers', None) or {}).get('Retry-After')
+        try:
+            return float(retryAfter)
+        except (TypeError, ValueError):
+            return self.RETRY_BACKOFF * (2 ** attempt) * random.uniform(0.5, 1.5)
+
     def add_postcredits(self, summaryPrompt):
         speakerPrefix = 'Ira Glass : '
         speakerPostfix = '\n'
-        postCreditsText = self.POST_CREDITS_DIALOGUE
+        postCreditsText = list(self.POST_CREDITS_DIALOGUE) # copied, the class list is shared by every episode
         postCreditsText.insert(1, 'The prompt for this episode was {0}'.format(summaryPrompt))
         formattedText = ""
         for postcredits in postCreditsText:
@@ -64,82 +200,214 @@ class Generator:
     def build_prompt(self, summaryPrompt, actName):
         return TAMTrainer.PROMPT.format(actName.lower(), summaryPrompt, TAMTrainer.PROMPT_END_TOKEN)
 
-    def run_query(self, prompt):
+    def build_episode_prompts(self, summaryPrompt, numberOfActs):
+        # the summary is grounded once and shared by every act, the post-credits still quote the prompt as given
+        summary = self.ground_summary(summaryPrompt)
+        return [self.build_prompt(summary, act) for act in self.episode_act_names(numberOfActs)]
+
+    def ground_summary(self, summaryPrompt):
+        # adds the summaries of the most similar scraped episodes and acts, so the model has real stories to draw on
+        if self.retrievalIndex is None or self.retrievalResults <= 0:
+            return summaryPrompt
+        with self.metrics.span('generate.retrieve'):
+            results = self.retrievalIndex.search(summaryPrompt, self.retrievalResults)
+        related = []
+        tokens = 0
+        for result in results:
+            if result.summary in related:
+                continue # identical summaries are only added once
+            tokens += self.trainer.count_tokens(result.summary)
+            if tokens > self.MAX_RETRIEVAL_TOKENS:
+                break
+            related.append(result.summary)
+        self.metrics.count('retrieval.summaries', len(related))
+        if not related:
+            return summaryPrompt
+        logging.debug('Grounding the prompt with {0} similar summaries'.format(len(related)))
+        return '{0} Similar stories: {1}'.format(summaryPrompt, ' '.join(related))
+
+    def run_query(self, prompt, stream=False):
         logging.debug('Running query {0} on model {1}...'.format(prompt, self.modelId))
-        return openai.Completion.create(
-            model=self.modelId,
-            prompt=prompt,
-            stop=TAMTrainer.COMPLETION_END_TOKEN,
-            max_tokens=(TAMTrainer.MAX_TOKENS - self.trainer.count_tokens(prompt))
-        )
+        promptTokens = self.trainer.count_tokens(prompt)
+        # a streamed completion returns once it starts, its text is counted by stream_act
+        with self.metrics.span('generate.completion_start' if stream else 'generate.completion'):
+            response = self.openai().Completion.create(
+                model=self.modelId,
+                prompt=prompt,
+                stop=TAMTrainer.COMPLETION_END_TOKEN,
+                max_tokens=(TAMTrainer.MAX_TOKENS - promptTokens),
+                stream=stream
+            )
+        self.metrics.count('completion.requests')
+        usage = {} if stream else (response.get('usage') or {})
+        self.metrics.count('completion.prompt_tokens', usage.get('prompt_tokens', promptTokens))
+        if not stream:
+            self.metrics.count('completion.completion_tokens', usage.get('completion_tokens', 0))
+        return response
+
+    def stream_query_with_retry(self, prompt):
+        # yields completion text as it arrives, it can only be retried until the first text is out
+        retryErrors = self.retry_errors()
+        for attempt in range(self.MAX_QUERY_RETRIES + 1):
+            started = False
+            try:
+                for chunk in self.run_query(prompt, stream=True):
+                    started = True
+                    yield chunk['choices'][0]['text']
+                return
+            except retryErrors as e:
+                if started or attempt == self.MAX_QUERY_RETRIES:
+                    raise
+                delay = self.retry_delay(attempt, e)
+                logging.warning('Query failed ({0}), retrying in {1:.1f} seconds...'.format(e, delay))
+                self.metrics.count('completion.retries')
+                time.sleep(delay)
 
     def parse_episode_data_to_script(self, episodeData):
-        scriptData = [] # { 'ACT1' : []} where [] is ordered speaking entries {'VOICE', 'TEXT'} (if an action, voice is ACTION)
-        for i, act in enumerate(episodeData): # first act is prologue, then acts 1,2,3,etc. then last is credits
-            if i == 0:
-                actName = 'prologue'
-            elif i == len(episodeData) - 1:
-                actName = 'post-credits'
-            elif i == len(episodeData) -2 :
-                actName = 'credits'
-            else:
-                actName = 'act {0}'.format(str(i))
-            actData = {actName.upper() : self.parse_text_into_act_data(act['choices'][0]['text'])}
-            scriptData.append(actData)
-        return scriptData
+        # list of script.Act, each with its utterances in order (stage directions have the speaker script.ACTION)
+        return script.from_episode_data(episodeData)
 
     def parse_text_into_act_data(self, openaiText):
-        # format is SPEAKER : SPEECH\nSPEAKER : SPEECH\n, etc.
-        # output is {'VOICE' : 'TEXT'} pairs in order
-        actData = []
-        speakingSegments = openaiText.split('\n')
-        for speech in speakingSegments:
-            if '[' in speech and ']' in speech: # this is an action (e.g. [ACKNOWLEDGEMENTS]), so it needs to be split out
-                actionSpeech = speech.split('[')[1]
-                actionSpeech = actionSpeech.split(']')[0]
-                actData.append({'ACTION' : actionSpeech})
-                speech = speech.replace('[{0}]'.format(actionSpeech), '')
-            if ':' not in speech: # likely end of segment
-                continue
-            splitSpeech = speech.split(':')
-            actData.append({splitSpeech[0].strip() : splitSpeech[1].strip()})
-        return actData
+        return script.parse_lines(openaiText)
+
+    def parse_stream_into_act_data(self, textStream):
+        return script.parse_stream(textStream)
 
     def generate_script(self, scriptData, filename):
         with open(filename, 'w') as f:
             f.write('# THIS AMERICAN LIFE GPT\n\n')
-            for actData in scriptData:
-                actName = list(actData.keys())[0]
-                actSpeeches = list(actData.values())[0]
-                f.write('\n## {0}\n'.format(actName))
-                for speech in actSpeeches:
-                    speaker = list(speech.keys())[0]
-                    speech = list(speech.values())[0]
-                    if speaker == 'ACTION':
-                        f.write('__[{0}]__\n\n'.format(speech))
+            for act in scriptData:
+                f.write('\n## {0}\n'.format(act.name))
+                for utterance in act.utterances:
+                    if utterance.is_action():
+                        f.write('__[{0}]__\n\n'.format(utterance.text))
                     else:
-                        f.write('__{0}__  :  {1}\n\n'.format(speaker, speech))
+                        f.write('__{0}__  :  {1}\n\n'.format(utterance.speaker, utterance.text))
 
     def generate_audio(self, scriptData, filename):
-        wavData = []
-        assignedVoices = {}
-        tts = TTS(self.VOICE_MODEL)
-        for actData in scriptData:
-            actSpeeches = list(actData.values())[0]
-            for speech in actSpeeches:
-                speaker = list(speech.keys())[0]
-                speech = list(speech.values())[0]
-                speaker_voice = self.assign_voice(speaker, assignedVoices, tts)
-                fixed_speech = self.change_pronunciation(speech)
-                if speaker == 'ACTION' or len(fixed_speech) == 0:
-                    # skips actions, long-term could play sound effect, etc.
-                    continue
-                else:
-                    wavData.extend(tts.tts(fixed_speech, speaker=speaker_voice))
-        os.makedirs(os.path.dirname(filename), exist_ok=True)
-        tts.synthesizer.save_wav(wav=wavData, path=filename)
+        outputFolder = os.path.dirname(filename)
+        speakers, sampleRate = self.load_voices()
+        assignedVoices = self.load_assigned_voices(outputFolder, speakers)
+        utterances = (utterance for act in scriptData for utterance in act.utterances)
+        os.makedirs(outputFolder, exist_ok=True)
+        try:
+            self.write_audio(self.synthesize_in_order(utterances, assignedVoices, speakers), filename, sampleRate)
+        finally:
+            self.save_data(assignedVoices, self.VOICES_FILENAME.format(outputFolder))
+
+    def load_assigned_voices(self, outputFolder, speakers):
+        # the voices an earlier run of this episode used, so its lines sound the same and come from the speech cache
+        filename = self.VOICES_FILENAME.format(outputFolder)
+        if self.newVoices or not os.path.exists(filename):
+            return {}
+        assignedVoices = {x : y for x, y in self.load_data(filename).items() if y in speakers}
+        logging.debug('Reusing {0} voices from {1}'.format(len(assignedVoices), filename))
+        return assignedVoices
+
+    def write_audio(self, utterances, filename, sampleRate):
+        # each utterance is appended to the file as soon as it is synthesized instead of collected in memory
+        from wavwriter import StreamingWavWriter
+        start = time.perf_counter()
+        writer = StreamingWavWriter(filename, sampleRate)
+        previousVoice = None
+        try:
+            for speakerVoice, wav in utterances:
+                with self.metrics.span('generate.wav_write'):
+                    if previousVoice is not None and speakerVoice != previousVoice:
+                        writer.write_silence(self.speakerSilence)
+                    writer.write(wav)
+                previousVoice = speakerVoice
+        finally:
+            with self.metrics.span('generate.wav_close'): # includes normalizing the finished file
+                writer.close()
+        synthesizedSeconds = self.synthesizedSamples / sampleRate
+        self.metrics.count('tts.audio_seconds', writer.seconds())
+        self.metrics.count('tts.synthesized_seconds', synthesizedSeconds)
+        self.log_synthesis_stats(time.perf_counter() - start, synthesizedSeconds)
+
+    def prepare_speech(self, utterance, assignedVoices, speakers):
+        # returns (voice, text) to synthesize, or None for entries without speech
+        speaker_voice = self.assign_voice(utterance.speaker, assignedVoices, speakers)
+        fixed_speech = self.change_pronunciation(utterance.text)
+        if utterance.is_action() or len(fixed_speech) == 0:
+            # skips actions, long-term could play sound effect, etc.
+            return None
+        return speaker_voice, fixed_speech
+
+    def synthesize_in_order(self, speeches, assignedVoices, speakers):
+        # yields (voice, audio) of each speech in script order, voices are always assigned here in order
+        # so parallel synthesis gets the same voices as serial synthesis
+        pending = deque()
+        window = 0 if self.ttsWorkers == 1 else self.ttsWorkers * self.TTS_QUEUE_PER_WORKER
+        for speech in speeches:
+            preparedSpeech = self.prepare_speech(speech, assignedVoices, speakers)
+            if preparedSpeech is None:
+                continue
+            pending.append(self.start_synthesis(preparedSpeech))
+            while len(pending) > window or (pending and self.is_synthesis_done(pending[0])):
+                yield self.finish_synthesis(pending.popleft())
+        while pending:
+            yield self.finish_synthesis(pending.popleft())
+
+    def start_synthesis(self, preparedSpeech):
+        # returns (voice, cacheKey, wav or future, synthesized), synthesized is False for lines from the cache
+        speaker_voice, fixed_speech = preparedSpeech
+        cacheKey = None
+        if self.ttsCache is not None:
+            cacheKey = self.ttsCache.key(self.VOICE_MODEL, speaker_voice, fixed_speech)
+            wav = self.ttsCache.get(cacheKey)
+            if wav is not None:
+                self.metrics.count('tts.cache_hits')
+                return speaker_voice, None, wav, False
+        if self.ttsWorkers == 1:
+            with self.metrics.span('generate.synthesize'):
+                return speaker_voice, cacheKey, synthesize(self.load_tts(), fixed_speech, speaker_voice), True
+        return speaker_voice, cacheKey, self.tts_pool().submit(synthesize_in_worker, fixed_speech, speaker_voice), True
+
+    def is_synthesis_done(self, synthesis):
+        return not hasattr(synthesis[2], 'result') or synthesis[2].done()
+
+    def finish_synthesis(self, synthesis):
+        speaker_voice, cacheKey, wav, synthesized = synthesis
+        if hasattr(wav, 'result'):
+            with self.metrics.span('generate.synthesis_wait'): # time spent waiting on the synthesis processes
+                wav = wav.result()
+        if cacheKey is not None:
+            self.ttsCache.put(cacheKey, wav)
+        if synthesized:
+            self.synthesizedUtterances += 1
+            self.synthesizedSamples += len(wav)
+            self.metrics.count('tts.utterances')
+        return speaker_voice, wav
+
+    def tts_pool(self):
+        # spawned so workers do not inherit torch threads from this process, each loads the model once
+        if self.ttsPool is None:
+            self.ttsPool = ProcessPoolExecutor(
+                max_workers=self.ttsWorkers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=init_tts_worker,
+                initargs=(self.VOICE_MODEL,))
+        return self.ttsPool
+
+    def close(self):
+        if self.ttsPool is not None:
+            self.ttsPool.shutdown()
+            self.ttsPool = None
+
+    def log_synthesis_stats(self, seconds, audioSeconds):
+        # audioSeconds only covers synthesized lines, so lines from the cache do not make the real-time factor look better
+        logging.info('Synthesized {0} utterances ({1:.1f} seconds of audio) in {2:.1f} seconds, real-time factor {3:.2f}'.format(
+            self.synthesizedUtterances,
+            audioSeconds,
+            seconds,
+            seconds / audioSeconds if audioSeconds else 0))
+        self.synthesizedUtterances = 0
+        self.synthesizedSamples = 0
+        if self.ttsCache is not None:
+            logging.info(self.ttsCache.stats())
         
-    def assign_voice(self, name, assignedVoices, tts):
+    def assign_voice(self, name, assignedVoices, speakers):
         name = name.upper()
         if name in assignedVoices.keys():
             return assignedVoices[name]
@@ -149,17 +417,14 @@ class Generator:
             randomVoice = None
             from random import randrange
             while randomVoice is None or randomVoice in assignedVoices.keys() or randomVoice in self.FIXED_VOICES.keys() or randomVoice in self.EXCLUDED_VOICES:
-                randIndex = randrange(len(tts.speakers))
-                randomVoice = tts.speakers[randIndex]
+                randIndex = randrange(len(speakers))
+                randomVoice = speakers[randIndex]
             assignedVoices[name] = randomVoice
             return randomVoice
 
     def change_pronunciation(self, text):
         # some voices are said weird (notably Ira Glass), so lets fix it
-        for word, pronunciation in self.PRONUNCIATION_FIXES.items():
-            if word in text:
-                text = text.replace(word, pronunciation)
-        return text
+        return self.lexicon.apply(text)
 
     def save_data(self, data, filename):
         os.makedirs(os.path.dirname(filename), exist_ok=True)
@@ -171,12 +436,110 @@ class Generator:
         with open(filename, 'r') as f:
             return json.load(f)
 
-    def run(self, summaryPrompt, episodeNumber, numberOfActs=2, episodeFolder=EPISODE_FOLDER, useExistingData=False):
+    def stream_act(self, prompt, actQueue, actTexts, index):
+        # producer for one act, parsed entries go on the act's queue as their lines complete
+        # the queue is unbounded so the completion is always read to the end, however far behind synthesis is
+        completionText = []
+        def completion_stream():
+            for text in self.stream_query_with_retry(prompt):
+                completionText.append(text)
+                yield text
+        try:
+            for speech in self.parse_stream_into_act_data(completion_stream()):
+                actQueue.put(speech)
+            actTexts[index] = ''.join(completionText)
+            self.metrics.count('completion.completion_tokens', self.trainer.count_tokens(actTexts[index]))
+        except Exception as e:
+            actQueue.put(e)
+        finally:
+            actQueue.put(None)
+
+    def run_streaming(self, summaryPrompt, episodeNumber, numberOfActs=2, episodeFolder=EPISODE_FOLDER):
+        # acts are generated concurrently while their finished lines are synthesized in script order,
+        # so speech synthesis overlaps generation instead of waiting for the whole episode
+        outputFolder = episodeFolder.format(episodeNumber)
+        partialFilename = '{0}/episodeData.partial.json'.format(outputFolder)
+        completedQueries = self.load_data(partialFilename) if os.path.exists(partialFilename) else {}
+        prompts = self.build_episode_prompts(summaryPrompt, numberOfActs)
+        actQueues = [queue.Queue() for _ in prompts]
+        actTexts = [None] * len(prompts)
+        postcreditsData = self.add_postcredits(summaryPrompt)
+        def streamed_speeches():
+            for actQueue in actQueues:
+                for speech in iter(actQueue.get, None):
+                    if isinstance(speech, Exception):
+                        raise speech
+                    yield speech
+            yield from self.parse_text_into_act_data(postcreditsData['choices'][0]['text'])
+        try:
+            os.makedirs(outputFolder, exist_ok=True)
+            # leaving the executor waits for every completion, so acts that finish are kept even when synthesis fails
+            with ThreadPoolExecutor(max_workers=self.queryWorkers) as executor:
+                for i, prompt in enumerate(prompts):
+                    if prompt in completedQueries:
+                        # finished by an earlier run, only its speech is still needed
+                        actTexts[i] = completedQueries[prompt]['choices'][0]['text']
+                        for speech in self.parse_text_into_act_data(actTexts[i]):
+                            actQueues[i].put(speech)
+                        actQueues[i].put(None)
+                    else:
+                        executor.submit(self.stream_act, prompt, actQueues[i], actTexts, i)
+                speakers, sampleRate = self.load_voices() # loads while the first lines are generated
+                assignedVoices = self.load_assigned_voices(outputFolder, speakers)
+                try:
+                    with self.metrics.span('generate.stream'): # generation and synthesis together, they overlap
+                        self.write_audio(self.synthesize_in_order(streamed_speeches(), assignedVoices, speakers), '{0}/audio.wav'.format(outputFolder), sampleRate)
+                finally:
+                    self.save_data(assignedVoices, self.VOICES_FILENAME.format(outputFolder))
+            episodeData = [{'choices' : [{'text' : x}]} for x in actTexts]
+            episodeData.append(postcreditsData)
+            self.save_data(episodeData, '{0}/episodeData.json'.format(outputFolder))
+            if os.path.exists(partialFilename):
+                os.remove(partialFilename)
+            with self.metrics.span('generate.write_script'):
+                self.generate_script(self.parse_episode_data_to_script(episodeData), '{0}/script.md'.format(outputFolder))
+        except Exception as e:
+            finishedQueries = {x : {'choices' : [{'text' : y}]} for x, y in zip(prompts, actTexts) if y is not None}
+            if finishedQueries:
+                # same file as query_episode, so the next run (streamed or not) only asks for the missing acts
+                self.save_data(finishedQueries, partialFilename)
+            logging.error("Failed to stream the episode. Check your inputs.")
+            logging.error(e)
+            return False
+        return True
+
+    def query_episode(self, summaryPrompt, outputFolder, numberOfActs=2):
+        # queries and saves the episode data, acts finished before a failure are kept for the next attempt
+        partialFilename = '{0}/episodeData.partial.json'.format(outputFolder)
+        completedQueries = self.load_data(partialFilename) if os.path.exists(partialFilename) else {}
+        try:
+            with self.metrics.span('generate.query'):
+                episodeData = self.query_episode_data(summaryPrompt, numberOfActs=numberOfActs, completedQueries=completedQueries)
+            self.save_data(episodeData, '{0}/episodeData.json'.format(outputFolder))
+        except Exception:
+            if completedQueries:
+                # finished acts are reused by the next run instead of being paid for again
+                self.save_data(completedQueries, partialFilename)
+            raise
+        if os.path.exists(partialFilename):
+            os.remove(partialFilename)
+        return episodeData
+
+    def produce_episode(self, episodeData, outputFolder):
+        with self.metrics.span('generate.parse_script'):
+            scriptData = self.parse_episode_data_to_script(episodeData)
+        with self.metrics.span('generate.write_script'):
+            self.generate_script(scriptData, '{0}/script.md'.format(outputFolder))
+        with self.metrics.span('generate.audio'):
+            self.generate_audio(scriptData, '{0}/audio.wav'.format(outputFolder))
+
+    def run(self, summaryPrompt, episodeNumber, numberOfActs=2, episodeFolder=EPISODE_FOLDER, useExistingData=False, stream=False):
+        if stream and not useExistingData:
+            return self.run_streaming(summaryPrompt, episodeNumber, numberOfActs=numberOfActs, episodeFolder=episodeFolder)
         outputFolder = episodeFolder.format(episodeNumber)
         if not useExistingData:
             try:
-                episodeData = self.query_episode_data(summaryPrompt, numberOfActs=numberOfActs)
-                self.save_data(episodeData, '{0}/episodeData.json'.format(outputFolder))
+                episodeData = self.query_episode(summaryPrompt, outputFolder, numberOfActs=numberOfActs)
             except Exception as e:
                 logging.error("Failed to query episode data. Check your inputs.")
                 logging.error(e)
@@ -184,9 +547,7 @@ class Generator:
         else:
             episodeData = self.load_data('{0}/episodeData.json'.format(outputFolder))
         try:
-            scriptData = self.parse_episode_data_to_script(episodeData)
-            self.generate_script(scriptData, '{0}/script.md'.format(outputFolder))
-            self.generate_audio(scriptData, '{0}/audio.wav'.format(outputFolder))
+            self.produce_episode(episodeData, outputFolder)
         except Exception as e:
             logging.error("Failed to generate an episode from the episode data. Re-run ")
             logging.error(e)
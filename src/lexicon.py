@@ -0,0 +1,75 @@
+# respells words the voice model says wrong, every entry is applied in one pass over the text
+
+import json
+import logging
+import re
+
+class PronunciationLexicon:
+
+    # entries only match whole words, so 'PRI' does not change 'PRIZE'. the start of the word is checked
+    # outside the regex, a lookbehind at the front would stop re from skipping ahead to possible first letters
+    WORD_END = r'(?!\w)'
+    WORD_CHARACTER = re.compile(r'\w')
+
+    def __init__(self, entries=None):
+        self.entries = dict(entries or {}) # written word -> how it should be said
+        self.pattern = None # compiled the first time it is needed, then reused for every utterance
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, entries):
+        self.entries.update(entries)
+        self.pattern = None
+
+    def load(self, filename):
+        # a json object of {"word": "pronunciation"}, entries in the file replace existing ones
+        with open(filename, 'r') as f:
+            entries = json.load(f)
+        if not isinstance(entries, dict) or not all(isinstance(x, str) and isinstance(y, str) for x, y in entries.items()):
+            raise ValueError('{0} must be a json object of word to pronunciation strings'.format(filename))
+        self.add({x : y for x, y in entries.items() if x})
+        logging.debug('Loaded {0} pronunciations from {1}'.format(len(entries), filename))
+
+    def compile(self):
+        # the words are merged into a trie shaped regex, so matching stays linear in the text however many entries there are
+        trie = {}
+        for word in self.entries:
+            node = trie
+            for char in word:
+                node = node.setdefault(char, {})
+            node[''] = True
+        return re.compile(self.trie_pattern(trie) + self.WORD_END)
+
+    def trie_pattern(self, node):
+        branches = [re.escape(char) + self.trie_pattern(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        pattern = branches[0] if len(branches) == 1 else '(?:{0})'.format('|'.join(branches))
+        if '' in node:
+            # a word can end here, longer words are still tried first
+            pattern = '(?:{0})?'.format(pattern)
+        return pattern
+
+    def apply(self, text):
+        if not self.entries:
+            return text
+        if self.pattern is None:
+            self.pattern = self.compile()
+        pieces = []
+        position = 0 # text before this is already in pieces
+        match = self.pattern.search(text)
+        while match is not None:
+            start = match.start()
+            if start > 0 and self.WORD_CHARACTER.match(text, start - 1):
+                # starts inside a word, a real match could still begin at the next character
+                match = self.pattern.search(text, start + 1)
+                continue
+            pieces.append(text[position:start])
+            pieces.append(self.entries[match.group(0)])
+            position = match.end()
+            match = self.pattern.search(text, position)
+        if not pieces:
+            return text
+        pieces.append(text[position:])
+        return ''.join(pieces)
@@ -0,0 +1,77 @@
+# timing spans and counters for each stage of a run, written as json and summarized at the end
+
+from contextlib import contextmanager
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+class Metrics:
+
+    FILENAME = '../metrics.json'
+
+    def __init__(self):
+        self.spans = {} # name -> [calls, seconds], seconds are summed across threads
+        self.counters = {} # name -> total
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_span(name, time.perf_counter() - start)
+
+    def add_span(self, name, seconds):
+        with self.lock:
+            span = self.spans.setdefault(name, [0, 0.0])
+            span[0] += 1
+            span[1] += seconds
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def peak_rss_mb(self):
+        # peak resident memory of this process and, separately, its largest finished child (pool workers)
+        try:
+            import resource
+        except ImportError:
+            return None, None # not available on windows
+        perMb = 1024 * 1024 if sys.platform == 'darwin' else 1024 # ru_maxrss is bytes on macOS, kilobytes elsewhere
+        return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / perMb,
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / perMb)
+
+    def to_dict(self):
+        peakRss, peakChildRss = self.peak_rss_mb()
+        with self.lock:
+            return {
+                'wall_seconds' : time.perf_counter() - self.started,
+                'spans' : {name : {'calls' : calls, 'seconds' : seconds} for name, (calls, seconds) in sorted(self.spans.items())},
+                'counters' : dict(sorted(self.counters.items())),
+                'peak_rss_mb' : peakRss,
+                'peak_child_rss_mb' : peakChildRss
+            }
+
+    def save(self, filename=FILENAME):
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        with open(filename, 'w') as f:
+            json.dump(self.to_dict(), f, indent=4)
+        logging.debug('Saved metrics to {0}'.format(filename))
+
+    def summary(self):
+        data = self.to_dict()
+        lines = ['Finished in {0:.1f} seconds'.format(data['wall_seconds'])]
+        if data['spans']:
+            lines.append('{0:<28} {1:>8} {2:>10} {3:>10}'.format('stage', 'calls', 'seconds', 'mean'))
+            for name, span in data['spans'].items():
+                lines.append('{0:<28} {1:>8} {2:>10.2f} {3:>10.4f}'.format(name, span['calls'], span['seconds'], span['seconds'] / span['calls']))
+        for name, total in data['counters'].items():
+            lines.append('{0:<28} {1:>8}'.format(name, round(total, 1) if isinstance(total, float) else total))
+        if data['peak_rss_mb'] is not None:
+            lines.append('Peak memory {0:.0f} MB (largest child process {1:.0f} MB)'.format(data['peak_rss_mb'], data['peak_child_rss_mb']))
+        return '\n'.join(lines)
@@ -0,0 +1,71 @@
+# on-disk cache of scraped pages so re-scrapes only download new or changed pages
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+class ResponseCache:
+
+    CACHE_FOLDER = '../cache/http'
+    DEFAULT_TTL = 7 * 24 * 60 * 60 # seconds before a cached page is revalidated with the server
+
+    def __init__(self, folder=CACHE_FOLDER, ttl=DEFAULT_TTL):
+        self.folder = folder
+        self.ttl = ttl
+        os.makedirs(self.folder, exist_ok=True)
+
+    def paths(self, url):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.folder, key + '.html'), os.path.join(self.folder, key + '.json')
+
+    def load(self, url):
+        # returns (metadata, content) or (None, None) if the url has not been cached
+        contentPath, metaPath = self.paths(url)
+        try:
+            with open(metaPath, 'r') as f:
+                meta = json.load(f)
+            with open(contentPath, 'rb') as f:
+                content = f.read()
+        except (OSError, ValueError):
+            return None, None
+        return meta, content
+
+    def is_fresh(self, meta):
+        return meta is not None and time.time() - meta['fetched'] < self.ttl
+
+    def revalidation_headers(self, meta):
+        headers = {}
+        if meta is None:
+            return headers
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('lastModified'):
+            headers['If-Modified-Since'] = meta['lastModified']
+        return headers
+
+    def store(self, url, response):
+        contentPath, metaPath = self.paths(url)
+        meta = {
+            'url' : url,
+            'etag' : response.headers.get('ETag'),
+            'lastModified' : response.headers.get('Last-Modified'),
+            'fetched' : time.time()
+        }
+        self.write_atomic(contentPath, response.content, 'wb')
+        self.write_atomic(metaPath, json.dumps(meta), 'w')
+
+    def refresh(self, url, meta):
+        # server confirmed the cached copy is still current (304), so restart its ttl
+        _, metaPath = self.paths(url)
+        meta['fetched'] = time.time()
+        self.write_atomic(metaPath, json.dumps(meta), 'w')
+        logging.debug('Cached page still current for {0}'.format(url))
+
+    def write_atomic(self, path, data, mode):
+        tmpPath = '{0}.{1}.{2}.tmp'.format(path, os.getpid(), threading.get_ident())
+        with open(tmpPath, mode) as f:
+            f.write(data)
+        os.replace(tmpPath, path)
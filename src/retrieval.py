@@ -0,0 +1,183 @@
+# bm25 index over the scraped episode and act summaries, used to ground generation prompts in similar real episodes
+
+from collections import Counter, namedtuple
+import io
+import json
+import logging
+import os
+import re
+
+SearchResult = namedtuple('SearchResult', ['score', 'episodeNumber', 'actId', 'name', 'summary'])
+
+class EpisodeIndex:
+
+    FILENAME = '../index/episodes.npz'
+    VERSION = 2
+    K1 = 1.2 # how quickly repeats of a term stop adding to the score
+    B = 0.75 # how much longer summaries are penalized
+    DEFAULT_RESULTS = 3
+    WORD_PATTERN = re.compile(r'\w+')
+
+    def __init__(self, filename=FILENAME):
+        self.filename = filename
+        self.terms = {} # term -> term id, the postings of term id t are postingDocs/postingFreqs[termOffsets[t]:termOffsets[t + 1]]
+        self.documents = [] # doc id -> [episodeNumber, actId, name, summary], actId is None for the episode summary
+        self.episodeNumbers = set()
+        self.episodeDigests = {} # episodeNumber -> hex digest of the corpus entry it was indexed from
+        self.termOffsets = None
+        self.postingDocs = None
+        self.postingFreqs = None
+        self.docLengths = None
+        self.lengthNorms = None # per document part of the bm25 denominator, only changes when documents are added
+
+    def __len__(self):
+        return len(self.documents)
+
+    def tokenize(self, text):
+        return self.WORD_PATTERN.findall(text.lower())
+
+    def episode_documents(self, episodeNumber, episodeData):
+        # the episode summary and then each act summary, acts without one (credits) are left out
+        if episodeData.get('summary'):
+            yield [episodeNumber, None, episodeData.get('episodeName', ''), episodeData['summary']]
+        for actId, act in episodeData.get('Acts', {}).items():
+            if act.get('summary'):
+                yield [episodeNumber, actId, act.get('name', ''), act['summary']]
+
+    def changed_episodes(self, entryDigests):
+        # indexed episodes whose latest corpus entry is no longer the one they were indexed from, entryDigests is from EpisodeCorpus.entry_digests
+        return {x for x in self.episodeNumbers if self.episodeDigests.get(x) != (entryDigests[x].hex() if x in entryDigests else None)}
+
+    def update(self, records, entryDigests=None):
+        # records are (episodeNumber, episodeData), episodes already in the index are skipped
+        # new postings are merged into the existing arrays in one sort instead of re-tokenizing the corpus
+        import numpy as np
+        newTerms, newDocs, newFreqs, newLengths = [], [], [], []
+        addedEpisodes = 0
+        for episodeNumber, episodeData in records:
+            if episodeNumber in self.episodeNumbers:
+                continue
+            self.episodeNumbers.add(episodeNumber)
+            if entryDigests is not None and episodeNumber in entryDigests:
+                self.episodeDigests[episodeNumber] = entryDigests[episodeNumber].hex()
+            addedEpisodes += 1
+            for document in self.episode_documents(episodeNumber, episodeData):
+                tokens = self.tokenize('{0} {1}'.format(document[2], document[3]))
+                docId = len(self.documents)
+                self.documents.append(document)
+                newLengths.append(len(tokens))
+                for term, count in Counter(tokens).items():
+                    newTerms.append(self.terms.setdefault(term, len(self.terms)))
+                    newDocs.append(docId)
+                    newFreqs.append(count)
+        if not newDocs and self.termOffsets is not None:
+            return addedEpisodes
+        if self.termOffsets is None:
+            self.termOffsets = np.zeros(1, dtype=np.int64)
+            self.postingDocs = np.zeros(0, dtype=np.int32)
+            self.postingFreqs = np.zeros(0, dtype=np.float32)
+            self.docLengths = np.zeros(0, dtype=np.int32)
+        oldTerms = np.repeat(np.arange(len(self.termOffsets) - 1, dtype=np.int64), np.diff(self.termOffsets))
+        allTerms = np.concatenate([oldTerms, np.array(newTerms, dtype=np.int64)])
+        order = np.argsort(allTerms, kind='stable') # new doc ids are all higher, so postings stay in doc order
+        self.postingDocs = np.concatenate([self.postingDocs, np.array(newDocs, dtype=np.int32)])[order]
+        self.postingFreqs = np.concatenate([self.postingFreqs, np.array(newFreqs, dtype=np.float32)])[order]
+        self.termOffsets = np.concatenate([[0], np.cumsum(np.bincount(allTerms, minlength=len(self.terms)))]).astype(np.int64)
+        self.docLengths = np.concatenate([self.docLengths, np.array(newLengths, dtype=np.int32)])
+        self.lengthNorms = None
+        return addedEpisodes
+
+    def remove(self, episodeNumbers):
+        # drops the documents of these episodes so they can be indexed again, returns how many episodes were removed
+        import numpy as np
+        episodeNumbers = set(episodeNumbers) & self.episodeNumbers
+        if not episodeNumbers:
+            return 0
+        keep = np.array([x[0] not in episodeNumbers for x in self.documents], dtype=bool)
+        newDocIds = np.cumsum(keep) - 1 # kept documents keep their order, so postings stay in doc order
+        postingTerms = np.repeat(np.arange(len(self.termOffsets) - 1, dtype=np.int64), np.diff(self.termOffsets))
+        keptPostings = keep[self.postingDocs]
+        self.postingDocs = newDocIds[self.postingDocs[keptPostings]].astype(np.int32)
+        self.postingFreqs = self.postingFreqs[keptPostings]
+        self.termOffsets = np.concatenate([[0], np.cumsum(np.bincount(postingTerms[keptPostings], minlength=len(self.terms)))]).astype(np.int64)
+        self.docLengths = self.docLengths[keep]
+        self.documents = [x for x, kept in zip(self.documents, keep) if kept]
+        self.episodeNumbers -= episodeNumbers
+        for episodeNumber in episodeNumbers:
+            self.episodeDigests.pop(episodeNumber, None)
+        self.lengthNorms = None
+        return len(episodeNumbers)
+
+    def length_norms(self):
+        if self.lengthNorms is None:
+            averageLength = max(float(self.docLengths.mean()), 1.0)
+            self.lengthNorms = (self.K1 * (1 - self.B + self.B * self.docLengths / averageLength)).astype('float32')
+        return self.lengthNorms
+
+    def search(self, query, k=DEFAULT_RESULTS):
+        # scores only the documents that share a term with the query, with all their postings at once
+        if not self.documents or k <= 0:
+            return []
+        import numpy as np
+        termIds = sorted({self.terms[x] for x in self.tokenize(query) if x in self.terms})
+        if not termIds:
+            return []
+        starts = self.termOffsets[termIds]
+        ends = self.termOffsets[np.array(termIds) + 1]
+        documentFrequencies = ends - starts
+        idf = np.log(1 + (len(self.documents) - documentFrequencies + 0.5) / (documentFrequencies + 0.5))
+        postings = np.concatenate([np.arange(x, y) for x, y in zip(starts, ends)])
+        docs = self.postingDocs[postings]
+        freqs = self.postingFreqs[postings]
+        weights = np.repeat(idf, documentFrequencies) * freqs * (self.K1 + 1) / (freqs + self.length_norms()[docs])
+        scores = np.bincount(docs, weights=weights, minlength=len(self.documents))
+        k = min(k, np.count_nonzero(scores))
+        best = np.argpartition(-scores, k - 1)[:k] # the k best in any order, without sorting every document
+        best = best[np.argsort(-scores[best], kind='stable')]
+        return [SearchResult(float(scores[x]), *self.documents[x]) for x in best]
+
+    def load(self):
+        # returns False when there is no index yet
+        if not os.path.exists(self.filename):
+            return False
+        import numpy as np
+        with np.load(self.filename) as data:
+            metadata = json.loads(data['metadata'].tobytes().decode('utf-8'))
+            if metadata.get('version') != self.VERSION:
+                logging.warning('Ignoring {0}, it was written by another version and will be rebuilt'.format(self.filename))
+                return False
+            self.termOffsets = data['termOffsets']
+            self.postingDocs = data['postingDocs']
+            self.postingFreqs = data['postingFreqs']
+            self.docLengths = data['docLengths']
+        self.terms = {x : i for i, x in enumerate(metadata['terms'])}
+        self.documents = metadata['documents']
+        self.episodeNumbers = set(metadata['episodeNumbers'])
+        self.episodeDigests = {int(x) : y for x, y in metadata['episodeDigests'].items()}
+        self.lengthNorms = None
+        logging.debug('Loaded retrieval index of {0} episodes from {1}'.format(len(self.episodeNumbers), self.filename))
+        return True
+
+    def save(self):
+        import numpy as np
+        metadata = {
+            'version' : self.VERSION,
+            'terms' : sorted(self.terms, key=self.terms.get),
+            'documents' : self.documents,
+            'episodeNumbers' : sorted(self.episodeNumbers),
+            'episodeDigests' : {str(x) : y for x, y in sorted(self.episodeDigests.items())}
+        }
+        # everything goes in one file, so replacing it keeps the arrays and their terms in step
+        buffer = io.BytesIO()
+        np.savez(buffer,
+            metadata=np.frombuffer(json.dumps(metadata).encode('utf-8'), dtype=np.uint8),
+            termOffsets=self.termOffsets,
+            postingDocs=self.postingDocs,
+            postingFreqs=self.postingFreqs,
+            docLengths=self.docLengths)
+        os.makedirs(os.path.dirname(self.filename) or '.', exist_ok=True)
+        tmpFilename = '{0}.{1}.tmp'.format(self.filename, os.getpid())
+        with open(tmpFilename, 'wb') as f:
+            f.write(buffer.getbuffer())
+        os.replace(tmpFilename, self.filename)
+        logging.debug('Saved retrieval index of {0} documents to {1}'.format(len(self.documents), self.filename))
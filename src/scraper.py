@@ -1,25 +1,134 @@
 # scrapes data from This American Life and formats into trainable data
 # Created by Michael Kukar 2023
 
-import requests
-from bs4 import BeautifulSoup
+# requests and bs4 are imported where they are used so the cli starts quickly for other actions
+from concurrent.futures import ThreadPoolExecutor
+import importlib.util
 import logging
-import json
+import threading
+import time
+
+from corpus import EpisodeCorpus
+from metrics import Metrics
+
+class RateLimiter:
+    # spaces out calls so that no more than requestsPerSecond are started across all threads
+
+    def __init__(self, requestsPerSecond):
+        self.interval = 1.0 / requestsPerSecond if requestsPerSecond else 0
+        self.nextSlot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.nextSlot)
+            self.nextSlot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
 
 class Scraper:
 
     SOUP_PARSER = 'html.parser'
-    OUTPUT_FILENAME = '../episodes.json'
+    PARSER_BACKENDS = ['lxml', 'html.parser'] # fastest first, html.parser always works
+    SUMMARY_BODY_CLASS = 'field field-name-body field-type-text-with-summary field-label-hidden'
+    # only the parts of each page that get read are built into the tree
+    TRANSCRIPT_TAGS = ['a', 'h1', 'article']
+    SUMMARY_TAGS = ['header', 'a']
+    OUTPUT_FILENAME = EpisodeCorpus.FILENAME
+    JSON_OUTPUT_FILENAME = '../episodes.json'
     SOURCE_URL = 'https://thisamericanlife.org/'
     TRANSCRIPT_URI = '{0}/transcript' # episode number
+    DEFAULT_WORKERS = 1
+    DEFAULT_REQUESTS_PER_SECOND = 4
+    MAX_RETRIES = 5
+    RETRY_BACKOFF_FACTOR = 1
+    RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+    REQUEST_TIMEOUT = 30 # seconds
+
+    def __init__(self, workers=DEFAULT_WORKERS, requestsPerSecond=DEFAULT_REQUESTS_PER_SECOND, cache=None, parser=None, partialParse=True, metrics=None):
+        self.workers = max(1, workers)
+        self.parser = parser if parser is not None else self.default_parser()
+        self.partialParse = partialParse
+        self.strainers = self.create_strainers()
+        self.rateLimiter = RateLimiter(requestsPerSecond)
+        self.session = self.create_session()
+        self.cache = cache # ResponseCache, or None to always download
+        self.corpusLock = threading.Lock()
+        self.metrics = metrics if metrics is not None else Metrics()
+
+    def create_strainers(self):
+        from bs4 import SoupStrainer
+        return {
+            'transcript' : SoupStrainer(self.TRANSCRIPT_TAGS),
+            'summary' : SoupStrainer(self.SUMMARY_TAGS),
+            'actSummary' : SoupStrainer('div', class_=self.SUMMARY_BODY_CLASS)
+        }
+
+    def create_session(self):
+        # one pooled session shared by every worker so connections are kept alive between pages
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        retry = Retry(
+            total=self.MAX_RETRIES,
+            backoff_factor=self.RETRY_BACKOFF_FACTOR,
+            status_forcelist=self.RETRY_STATUS_CODES,
+            respect_retry_after_header=True
+        )
+        adapter = HTTPAdapter(pool_connections=self.workers, pool_maxsize=self.workers, max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def default_parser(self):
+        for backend in self.PARSER_BACKENDS:
+            if backend == self.SOUP_PARSER or importlib.util.find_spec(backend) is not None:
+                logging.debug('Using {0} to parse pages'.format(backend))
+                return backend
+        return self.SOUP_PARSER
+
+    def make_soup(self, content, strainer):
+        from bs4 import BeautifulSoup
+        with self.metrics.span('scrape.parse'):
+            return BeautifulSoup(content, self.parser, parse_only=strainer if self.partialParse else None)
+
+    def download(self, url, headers=None):
+        with self.metrics.span('scrape.rate_limit_wait'):
+            self.rateLimiter.wait()
+        with self.metrics.span('scrape.download'):
+            page = self.session.get(url, headers=headers, timeout=self.REQUEST_TIMEOUT)
+        self.metrics.count('http.requests')
+        self.metrics.count('http.bytes', len(page.content))
+        return page
+
+    def fetch(self, url):
+        if self.cache is None:
+            page = self.download(url)
+            page.raise_for_status()
+            return page.content
+        meta, content = self.cache.load(url)
+        if self.cache.is_fresh(meta):
+            self.metrics.count('http.cache_hits')
+            return content
+        page = self.download(url, headers=self.cache.revalidation_headers(meta))
+        if page.status_code == 304 and content is not None:
+            self.metrics.count('http.not_modified')
+            self.cache.refresh(url, meta)
+            return content
+        page.raise_for_status()
+        self.cache.store(url, page)
+        return page.content
 
     def parse_transcript(self, episodeNumber):
         logging.debug('parsing transcript for episode {0}'.format(episodeNumber))
         transcriptData = {}
         
         url = self.SOURCE_URL + self.TRANSCRIPT_URI.format(str(episodeNumber))
-        page = requests.get(url)
-        soup = BeautifulSoup(page.content, self.SOUP_PARSER)
+        soup = self.make_soup(self.fetch(url), self.strainers['transcript'])
 
         transcriptData['episodeLinkName'] = soup.find('a', class_='full-episode goto goto-episode')['href']
         transcriptData['episodeName'] = soup.find('h1').text.split(':')[1].strip()
@@ -53,11 +162,10 @@ class Scraper:
     def parse_summary(self, summaryLink, transcriptData):
         logging.debug('parsing summary for {0}'.format(summaryLink))
         url = self.SOURCE_URL + summaryLink
-        page = requests.get(url)
-        soup = BeautifulSoup(page.content, self.SOUP_PARSER)
+        soup = self.make_soup(self.fetch(url), self.strainers['summary'])
 
         transcriptData['summary'] = ''
-        summaryDiv = soup.find('header', class_='episode-header').find('div', class_='field field-name-body field-type-text-with-summary field-label-hidden')
+        summaryDiv = soup.find('header', class_='episode-header').find('div', class_=self.SUMMARY_BODY_CLASS)
         try:
             transcriptData['summary'] = summaryDiv.find('p').text
         except AttributeError as e:
@@ -72,9 +180,8 @@ class Scraper:
     def parse_act_summary(self, actSummaryLink):
         logging.debug('parsing act summary for {0}'.format(actSummaryLink))
         url = self.SOURCE_URL + actSummaryLink
-        page = requests.get(url)
-        soup = BeautifulSoup(page.content, self.SOUP_PARSER)
-        summaryDiv = soup.find('div', class_='field field-name-body field-type-text-with-summary field-label-hidden')
+        soup = self.make_soup(self.fetch(url), self.strainers['actSummary'])
+        summaryDiv = soup.find('div', class_=self.SUMMARY_BODY_CLASS)
         try:
             return summaryDiv.find('p').text
         except AttributeError as e:
@@ -111,18 +218,40 @@ class Scraper:
         fullData = self.parse_summary(transcriptData['episodeLinkName'], transcriptData)
         return fullData
 
-    def save_data(self, episode_data, filename):
-        with open(filename, 'w') as f:
-            json.dump(episode_data, f, indent=4)
+    def try_parse(self, curEpisode, corpus=None, corpusFile=None, latestDigests=None):
+        try:
+            episodeData = self.parse(curEpisode)
+        except Exception as e:
+            logging.error("Failed to parse episode {0}, skipping...".format(curEpisode))
+            logging.error(e)
+            self.metrics.count('scrape.failed_episodes')
+            return False
+        self.metrics.count('scrape.episodes')
+        if corpusFile is not None:
+            # written as soon as it is scraped, so a crashed run resumes from here
+            with self.corpusLock:
+                if not corpus.append(corpusFile, curEpisode, episodeData, latestDigests):
+                    self.metrics.count('scrape.unchanged_episodes')
+        return True
 
-    def run(self, startEpisode=1, endEpisode=1, output_filename=OUTPUT_FILENAME):
-        episodeData = []
-        curEpisode = startEpisode
-        while curEpisode <= endEpisode:
-            try:
-                episodeData.append(self.parse(curEpisode))
-            except Exception as e:
-                logging.error("Failed to parse episode {0}, skipping...".format(curEpisode))
-                logging.error(e)
-            curEpisode += 1
-        self.save_data(episodeData, filename=output_filename)
+    def run(self, startEpisode=1, endEpisode=1, output_filename=OUTPUT_FILENAME, refresh=False, json_filename=None):
+        episodes = range(startEpisode, endEpisode + 1)
+        corpus = EpisodeCorpus(output_filename)
+        # on refresh, episodes that come back unchanged are not appended again, so the corpus does not grow by a copy per refresh
+        latestDigests = corpus.entry_digests() if refresh else None
+        scrapedEpisodes = set(latestDigests) if refresh else corpus.episode_numbers()
+        # already scraped episodes are only re-parsed on refresh, where the cache keeps unchanged pages from downloading again
+        pendingEpisodes = [x for x in episodes if refresh or x not in scrapedEpisodes]
+        logging.info('Scraping {0} episodes ({1} already scraped)'.format(len(pendingEpisodes), len(episodes) - len(pendingEpisodes)))
+        with corpus.open_for_append() as corpusFile, self.metrics.span('scrape'):
+            scrapeEpisode = lambda curEpisode: self.try_parse(curEpisode, corpus, corpusFile, latestDigests)
+            if self.workers > 1:
+                with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                    list(executor.map(scrapeEpisode, pendingEpisodes))
+            else:
+                for curEpisode in pendingEpisodes:
+                    scrapeEpisode(curEpisode)
+        if json_filename is not None:
+            # episode order, identical to the array older versions wrote
+            with self.metrics.span('scrape.export_json'):
+                corpus.export_json(json_filename)
@@ -0,0 +1,102 @@
+# episode scripts as compact records, parsed from completion or transcript text in one pass
+
+from collections import Counter
+import json
+import re
+import sys
+
+ACTION = 'ACTION' # speaker of stage directions like [MUSIC], which are not spoken
+
+# one line per match: the speaker up to the first colon (or [), the colon, then the rest of the line without leading spaces,
+# the rest is matched with . since that is much faster than a character class over long speeches
+LINE_PATTERN = re.compile(r'^([^\n:\[]*)(:?)[ \t]*(.*)', re.MULTILINE)
+ACTION_PATTERN = re.compile(r'\[([^\]]*)\]')
+WORD_PATTERN = re.compile(r'\S+')
+
+class Utterance:
+    __slots__ = ('speaker', 'text')
+
+    def __init__(self, speaker, text):
+        self.speaker = sys.intern(speaker) # a few speakers say every line, so each name is only stored once
+        self.text = text
+
+    def is_action(self):
+        return self.speaker == ACTION
+
+    def __eq__(self, other):
+        return isinstance(other, Utterance) and self.speaker == other.speaker and self.text == other.text
+
+    def __repr__(self):
+        return 'Utterance({0!r}, {1!r})'.format(self.speaker, self.text)
+
+class Act:
+    __slots__ = ('name', 'utterances')
+
+    def __init__(self, name, utterances):
+        self.name = name
+        self.utterances = utterances
+
+    def __repr__(self):
+        return 'Act({0!r}, {1} utterances)'.format(self.name, len(self.utterances))
+
+def parse_lines(text):
+    # format is SPEAKER : SPEECH\nSPEAKER : SPEECH\n, an [ACTION] on a line comes out before its speech
+    utterances = []
+    for speaker, colon, speech in LINE_PATTERN.findall(text):
+        if '[' in speech:
+            utterances.extend(parse_line_with_action(speaker + colon + speech))
+        elif colon: # lines without a speaker are likely the end of a segment
+            utterances.append(Utterance(speaker.strip(), speech.strip()))
+    return utterances
+
+def parse_line_with_action(line):
+    # the rare lines with an [ACTION], the action is taken out and comes before the line's speech
+    match = ACTION_PATTERN.search(line)
+    if match is not None:
+        yield Utterance(ACTION, match.group(1))
+        line = line.replace(match.group(0), '')
+    speaker, colon, speech = line.partition(':')
+    if colon:
+        yield Utterance(speaker.strip(), speech.strip())
+
+def parse_stream(textStream):
+    # same output as parse_lines, but each utterance is yielded as soon as its line is complete
+    buffer = ''
+    for text in textStream:
+        buffer += text
+        end = buffer.rfind('\n')
+        if end != -1:
+            yield from parse_lines(buffer[:end])
+            buffer = buffer[end + 1:]
+    yield from parse_lines(buffer)
+
+def act_name(index, actCount):
+    # first act is prologue, then acts 1,2,3,etc. then credits and the post-credits last
+    if index == 0:
+        return 'PROLOGUE'
+    elif index == actCount - 1:
+        return 'POST-CREDITS'
+    elif index == actCount - 2:
+        return 'CREDITS'
+    return 'ACT {0}'.format(index)
+
+def from_episode_data(episodeData):
+    # episodeData is the list of completions saved in episodeData.json
+    return [Act(act_name(i, len(episodeData)), parse_lines(act['choices'][0]['text'])) for i, act in enumerate(episodeData)]
+
+def load_episode_data(filename):
+    with open(filename, 'r') as f:
+        return from_episode_data(json.load(f))
+
+def speaker_statistics(texts):
+    # (speaker, lines, words) for every speaker across the texts, most lines first
+    lines = Counter()
+    words = Counter()
+    for text in texts:
+        for utterance in parse_lines(text):
+            if utterance.is_action():
+                continue
+            speaker = utterance.speaker.upper()
+            lines[speaker] += 1
+            words[speaker] += len(WORD_PATTERN.findall(utterance.text))
+    return [(speaker, count, words[speaker]) for speaker, count in lines.most_common()]
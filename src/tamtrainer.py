@@ -1,11 +1,33 @@
 # fine tunes gpt3 using data from scraper
 # Created by Michael Kukar 2023
 
-from scraper import Scraper
+from corpus import EpisodeCorpus
+from metrics import Metrics
+from trainingsetbuilder import TrainingSetBuilder
 
+from concurrent.futures import ProcessPoolExecutor
 import json
 import logging
-from transformers import GPT2TokenizerFast
+import threading
+
+workerTokenizer = None # one tokenizer per pool process, loaded by init_token_worker
+
+def load_tokenizer(tokenizerName):
+    # transformers takes seconds to import, so it is only imported once tokens are actually counted
+    from transformers import GPT2TokenizerFast
+    return GPT2TokenizerFast.from_pretrained(tokenizerName)
+
+def init_token_worker(tokenizerName):
+    global workerTokenizer
+    workerTokenizer = load_tokenizer(tokenizerName)
+
+def count_tokens_in_worker(texts, tokenizer=None):
+    return [len(x) for x in (tokenizer or workerTokenizer)(texts)['input_ids']]
+
+def token_starts_in_worker(texts, tokenizer=None):
+    # character offset where each token of each text starts, all a split needs and much smaller to send back than offset pairs
+    offsets = (tokenizer or workerTokenizer)(texts, return_offsets_mapping=True)['offset_mapping']
+    return [[x[0] for x in textOffsets] for textOffsets in offsets]
 
 class TAMTrainer:
 
@@ -15,33 +37,29 @@ class TAMTrainer:
     MAX_TOKENS = 2048
     OUTPUT_FILENAME='../training_data.jsonl'
     PROMPT = 'Write a {0} for an episode of the This American Life podcast with the summary {1}{2}'
+    TOKENIZER_NAME = 'gpt2'
+    TOKEN_BATCH_SIZE = 256 # act texts sent to the tokenizer at once, gathered across episodes
+    DEFAULT_TOKEN_WORKERS = 1
+    loadedTokenizers = {} # tokenizer name -> tokenizer, shared so each process loads it at most once
+    tokenizerLock = threading.Lock() # concurrent queries can ask for the tokenizer at the same time
+
+    def __init__(self, tokenWorkers=DEFAULT_TOKEN_WORKERS, tokenCache=None, metrics=None):
+        self.tokenWorkers = max(1, tokenWorkers)
+        self.tokenCache = tokenCache # TokenCountCache, or None to always tokenize
+        self.tokenPool = None
+        self.metrics = metrics if metrics is not None else Metrics()
+
+    @property
+    def tokenizer(self):
+        with self.tokenizerLock:
+            if self.TOKENIZER_NAME not in self.loadedTokenizers:
+                with self.metrics.span('tokenizer_load'):
+                    self.loadedTokenizers[self.TOKENIZER_NAME] = load_tokenizer(self.TOKENIZER_NAME)
+        return self.loadedTokenizers[self.TOKENIZER_NAME]
 
-    def __init__(self):
-        self.tokenizer = GPT2TokenizerFast.from_pretrained('gpt2')
-
-    def load_scraper_data(self, filename=Scraper.OUTPUT_FILENAME):
-        with open(filename, 'r') as f:
-            return json.load(f)
-
-    def format_data_for_training(self, scraperData):
-        trainingSet = [] # format is {"prompt": "<prompt text>", "completion": "<ideal generated text>"},
-        for episodeData in scraperData:
-            trainingCandidates = self.format_by_episode(episodeData)
-            validatedEntries = [x for x in trainingCandidates if self.is_valid_entry(x)] # only allows in validated entries
-            trainingSet.extend(validatedEntries)
-        return trainingSet
-
-    def format_by_episode(self, episodeData):
-        # prompt: Write a <ACTNAME/PROLOGUE/CREDITS> for an episode of the This American Life podcast with the summary <SUMMARY>
-        # completion: <text>
-        trainingEntries = []
-        for actId in episodeData['Acts'].keys():
-            trainingEntry = {
-                'prompt' : self.format_by_episode_prompt(actId, episodeData),
-                'completion' : self.format_by_episode_completion(actId, episodeData)
-            }
-            trainingEntries.append(trainingEntry)
-        return trainingEntries
+    def load_scraper_data(self, filename=EpisodeCorpus.FILENAME, follow=False):
+        # generator over the scraped corpus, so only one episode is held in memory at a time
+        return EpisodeCorpus(filename).episodes(follow=follow)
 
     def format_by_episode_prompt(self, actId, episodeData):
         if 'act' in actId:
@@ -53,37 +71,71 @@ class TAMTrainer:
             episodeData['summary'], 
             self.PROMPT_END_TOKEN)
 
-    def format_by_episode_completion(self, actId, episodeData):
-        return "{0}{1}{2}".format(
-            self.COMPLETION_START_TOKEN,
-            episodeData['Acts'][actId]['text'],
-            self.COMPLETION_END_TOKEN
-        )
-
     def count_tokens(self, data):
         return len(self.tokenizer(data)['input_ids'])
 
-    def is_valid_entry(self, trainingEntry):
-        entryStr = trainingEntry['prompt'] + trainingEntry['completion']
-        tokenCount = self.count_tokens(entryStr)
-        if tokenCount <= self.MAX_TOKENS:
-            return True
-        else:
-            logging.warn('Detected an invalid entry (token count {0} is over max of {1} tokens), check your training data: {2}...'.format(tokenCount, self.MAX_TOKENS, entryStr[:50]))
-            return False
+    def count_tokens_batch(self, texts):
+        return self.map_tokenizer(count_tokens_in_worker, texts)
+
+    def token_starts_batch(self, texts):
+        return self.map_tokenizer(token_starts_in_worker, texts)
+
+    def map_tokenizer(self, tokenize, texts):
+        # small batches stay in this process, larger ones are split evenly across the token workers
+        if self.tokenWorkers == 1 or len(texts) < self.tokenWorkers:
+            return tokenize(texts, self.tokenizer)
+        if self.tokenPool is None:
+            self.tokenPool = ProcessPoolExecutor(max_workers=self.tokenWorkers, initializer=init_token_worker, initargs=(self.TOKENIZER_NAME,))
+        chunkSize = -(-len(texts) // self.tokenWorkers)
+        chunks = [texts[i:i + chunkSize] for i in range(0, len(texts), chunkSize)]
+        return [x for chunkResults in self.tokenPool.map(tokenize, chunks) for x in chunkResults]
+
+    def close(self):
+        if self.tokenPool is not None:
+            self.tokenPool.shutdown()
+            self.tokenPool = None
+        if self.tokenCache is not None:
+            self.tokenCache.save()
 
     # must be saved in JSONL format ({"prompt": "<prompt text>", "completion": "<ideal generated text>"} on each line)
     def save_training_data(self, trainingData, filename):
+        entryCount = 0
         with open(filename, 'w') as f:
             for entry in trainingData:
                 f.write(json.dumps(entry) + '\n')
+                entryCount += 1
+        return entryCount
 
-
-    def run(self, filename=OUTPUT_FILENAME, max_training_set=500):
-        data = self.load_scraper_data()
-        trainingData = self.format_data_for_training(data)
-        if len(trainingData) > max_training_set:
-            logging.warning('Training data size is {0} which is above max set size of {1}, limiting to {1}'.format(len(trainingData), max_training_set))
-            trainingData = trainingData[:max_training_set]
-        self.save_training_data(trainingData, filename=filename)
-        logging.debug('Training data saved with size of {0} to {1}'.format(len(trainingData), filename))        
+    def run(self, filename=OUTPUT_FILENAME, max_training_set=500, scraper_filename=EpisodeCorpus.FILENAME, follow=False, token_budget=None, duplicate_filter=None):
+        builder = TrainingSetBuilder(self, tokenBudget=token_budget, maxEntries=max_training_set, duplicateFilter=duplicate_filter)
+        try:
+            with self.metrics.span('train.plan'):
+                episodeWindows = builder.plan(self.load_scraper_data(scraper_filename, follow=follow), follow=follow)
+            self.metrics.count('train.planned_acts', builder.plannedActs)
+            self.metrics.count('train.tokenized_acts', builder.tokenizedActs)
+            logging.info('Planned {0} acts ({1} tokenized, {2} cached) at {3:.1f} entries/sec'.format(
+                builder.plannedActs,
+                builder.tokenizedActs,
+                builder.plannedActs - builder.tokenizedActs,
+                builder.plannedActs / builder.planSeconds if builder.planSeconds else 0))
+            if duplicate_filter is not None:
+                logging.info('Collapsed {0} near-duplicate acts, saving {1} tokens'.format(duplicate_filter.duplicates, builder.duplicateTokens))
+            with self.metrics.span('train.select'):
+                selected, totalTokens = builder.select(episodeWindows)
+            availableEntries = sum(len(x) for x in episodeWindows)
+            logging.info('Projected training set is {0} entries and {1} tokens ({2} entries available from {3} episodes)'.format(len(selected), totalTokens, availableEntries, len(episodeWindows)))
+            if len(selected) < availableEntries:
+                logging.warning('Training data is limited to {0} of {1} entries by the max set size of {2}{3}'.format(
+                    len(selected),
+                    availableEntries,
+                    max_training_set,
+                    '' if token_budget is None else ' and token budget of {0}'.format(token_budget)))
+            # second pass over the corpus only pulls out the selected text
+            with self.metrics.span('train.build'):
+                entryCount = self.save_training_data(builder.build(self.load_scraper_data(scraper_filename), selected), filename=filename)
+            self.metrics.count('train.entries', entryCount)
+            self.metrics.count('train.tokens', totalTokens)
+        finally:
+            self.close()
+        logging.debug('Training data saved with size of {0} to {1}'.format(entryCount, filename))
+        return totalTokens
@@ -4,25 +4,68 @@
 from scraper import Scraper
 from tamtrainer import TAMTrainer
 from generator import Generator
+from responsecache import ResponseCache
+from corpus import EpisodeCorpus
+from tokencache import TokenCountCache
+from dedup import NearDuplicateFilter
+from ttscache import UtteranceCache
+from batchrunner import BatchRunner
+from metrics import Metrics
+from lexicon import PronunciationLexicon
+from retrieval import EpisodeIndex
 
 import argparse
+import cProfile
 import logging
+import pstats
 import sys
 
+PROFILE_FILENAME = '../profile.prof'
+PROFILE_LINES = 30 # functions printed from the profile, by cumulative time
+
 def parse_arguments():
     parser = argparse.ArgumentParser(
         prog = 'thisamericanlifeGPT',
         description = 'Generates This American Life podcast episodes using gpt3'
     )
-    parser.add_argument('--action', choices=['scrape', 'train', 'run'], required=True)
+    parser.add_argument('--action', choices=['scrape', 'index', 'train', 'run', 'batch', 'convert'], required=True)
     parser.add_argument('--max-episodes', type=int, default=750, help='Max episodes to scrape (default 750)')
+    parser.add_argument('--workers', type=int, default=Scraper.DEFAULT_WORKERS, help='Number of episodes to scrape concurrently (default {0})'.format(Scraper.DEFAULT_WORKERS))
+    parser.add_argument('--requests-per-second', type=float, default=Scraper.DEFAULT_REQUESTS_PER_SECOND, help='Max requests per second sent while scraping, 0 for no limit (default {0})'.format(Scraper.DEFAULT_REQUESTS_PER_SECOND))
+    parser.add_argument('--html-parser', choices=Scraper.PARSER_BACKENDS, help='Parser used for scraped pages (default is the fastest installed)')
+    parser.add_argument('--cache-ttl', type=float, default=ResponseCache.DEFAULT_TTL / 3600, help='Hours before a cached page is revalidated with the site (default {0})'.format(ResponseCache.DEFAULT_TTL // 3600))
+    parser.add_argument('--no-cache', action='store_true', default=False, help='Always downloads pages instead of using the on-disk page cache')
+    parser.add_argument('--refresh', action='store_true', default=False, help='Re-scrapes episodes that are already in the checkpoint (unchanged pages come from the cache), for index rebuilds the whole index, for convert replaces the corpus instead of adding missing episodes')
+    parser.add_argument('--export-json', action='store_true', default=False, help='Also writes the scraped corpus as a single episodes.json array')
+    parser.add_argument('--no-index', action='store_true', default=False, help='Skips updating the retrieval index of episode summaries after scraping')
+    parser.add_argument('--index-file', default=EpisodeIndex.FILENAME, help='Retrieval index of the scraped episode summaries (default {0})'.format(EpisodeIndex.FILENAME))
+    parser.add_argument('--follow', action='store_true', default=False, help='Trains on the corpus while a scrape is still appending to it, until the max training entries or token budget can be filled')
+    parser.add_argument('--json-file', default=Scraper.JSON_OUTPUT_FILENAME, help='episodes.json file to convert to the line-delimited corpus (default {0})'.format(Scraper.JSON_OUTPUT_FILENAME))
     parser.add_argument('--max-training-entries', type=int, default=1000, help='Max training entries')
+    parser.add_argument('--training-token-budget', type=int, help='Max total tokens in the training set, which is what fine-tuning is billed on')
+    parser.add_argument('--dedup-threshold', type=float, default=NearDuplicateFilter.DEFAULT_THRESHOLD, help='Similarity (0-1) at which acts are collapsed as near-duplicates (default {0})'.format(NearDuplicateFilter.DEFAULT_THRESHOLD))
+    parser.add_argument('--no-dedup', action='store_true', default=False, help='Keeps near-duplicate acts in the training set')
+    parser.add_argument('--token-workers', type=int, default=TAMTrainer.DEFAULT_TOKEN_WORKERS, help='Processes used to tokenize acts for the training set (default {0})'.format(TAMTrainer.DEFAULT_TOKEN_WORKERS))
     parser.add_argument('--prompt', help='Prompt to run against trained model (required for run)')
     parser.add_argument('--model-id', help='ID of trained model (required for run)')
     parser.add_argument('--api-key', help='OpenAI API key (required for run)')
     parser.add_argument('--episode-number', type=int, help='Episode number to store output (required for run)')
     parser.add_argument('--acts', type=int, default=1, help='Number of acts to generate (default 1)')
-    parser.add_argument('--regenerate', action='store_true', default=False, help='Regenerates from existing data instead of making new queries (useful if you want different voices)')
+    parser.add_argument('--jobs-file', help='Line-delimited json jobs, one {"episodeNumber", "prompt", "acts"} per line (required for batch)')
+    parser.add_argument('--batch-episodes', type=int, default=BatchRunner.DEFAULT_EPISODES_AT_ONCE, help='Episodes queried at once in a batch while earlier episodes are synthesized (default {0})'.format(BatchRunner.DEFAULT_EPISODES_AT_ONCE))
+    parser.add_argument('--query-workers', type=int, default=Generator.DEFAULT_QUERY_WORKERS, help='Completions requested at once while generating (default {0})'.format(Generator.DEFAULT_QUERY_WORKERS))
+    parser.add_argument('--api-base', help='Alternate completion API base url, e.g. a local fake server for testing')
+    parser.add_argument('--stream', action='store_true', default=False, help='Synthesizes speech while the episode is still being generated')
+    parser.add_argument('--tts-workers', type=int, default=Generator.DEFAULT_TTS_WORKERS, help='Processes used for speech synthesis, each loads its own voice model (default {0})'.format(Generator.DEFAULT_TTS_WORKERS))
+    parser.add_argument('--speaker-silence', type=float, default=Generator.DEFAULT_SPEAKER_SILENCE, help='Seconds of silence added when the speaker changes (default {0})'.format(Generator.DEFAULT_SPEAKER_SILENCE))
+    parser.add_argument('--tts-cache-size', type=int, default=UtteranceCache.DEFAULT_MAX_BYTES // (1024 * 1024), help='Max MB of synthesized speech kept for reuse across runs (default {0})'.format(UtteranceCache.DEFAULT_MAX_BYTES // (1024 * 1024)))
+    parser.add_argument('--no-tts-cache', action='store_true', default=False, help='Always synthesizes speech instead of reusing cached lines')
+    parser.add_argument('--lexicon', help='Json file of {"word": "pronunciation"} fixes for the voices, added to the built-in ones')
+    parser.add_argument('--retrieval-results', type=int, default=Generator.DEFAULT_RETRIEVAL_RESULTS, help='Similar scraped episode summaries added to each prompt from the retrieval index (default {0}, none)'.format(Generator.DEFAULT_RETRIEVAL_RESULTS))
+    parser.add_argument('--regenerate', action='store_true', default=False, help='Regenerates from existing data instead of making new queries, with the voices the episode used before')
+    parser.add_argument('--new-voices', action='store_true', default=False, help='Assigns new random voices instead of reusing the ones saved in the episode folder (with --regenerate, to hear an episode with different voices)')
+    parser.add_argument('--metrics-file', default=Metrics.FILENAME, help='Json file the timing of each stage and run counters are written to (default {0})'.format(Metrics.FILENAME))
+    parser.add_argument('--profile', nargs='?', const=PROFILE_FILENAME, help='Runs the action under cProfile and saves the stats (default file {0})'.format(PROFILE_FILENAME))
     parser.add_argument('--debug', action='store_true', default=False, help='Prints debug logging messages')
     args = parser.parse_args()
 
@@ -31,33 +74,113 @@ def parse_arguments():
     print('\tAction               : {0}'.format(args.action))
     if args.action == 'scrape':
         print('\tMax Episodes         : {0}'.format(args.max_episodes))
+        print('\tWorkers              : {0}'.format(args.workers))
+        print('\tRequests Per Second  : {0}'.format(args.requests_per_second))
+        print('\tHTML Parser          : {0}'.format(args.html_parser or 'auto'))
+        print('\tCache TTL (hours)    : {0}'.format('disabled' if args.no_cache else args.cache_ttl))
+        print('\tRefresh?             : {0}'.format(args.refresh))
+        print('\tExport JSON?         : {0}'.format(args.export_json))
+        print('\tIndex File           : {0}'.format('disabled' if args.no_index else args.index_file))
+    elif args.action == 'index':
+        print('\tIndex File           : {0}'.format(args.index_file))
+        print('\tRebuild?             : {0}'.format(args.refresh))
     elif args.action == 'train':
         print('\tMax Training Entries : {0}'.format(args.max_training_entries))
+        print('\tToken Budget         : {0}'.format(args.training_token_budget))
+        print('\tDedup Threshold      : {0}'.format('disabled' if args.no_dedup else args.dedup_threshold))
+        print('\tFollow Scrape?       : {0}'.format(args.follow))
+        print('\tToken Workers        : {0}'.format(args.token_workers))
+    elif args.action == 'convert':
+        print('\tJSON File            : {0}'.format(args.json_file))
+        print('\tReplace Corpus?      : {0}'.format(args.refresh))
     elif args.action == 'run':
         print('\tPrompt               : {0}'.format(args.prompt))
         print('\tModel ID             : {0}'.format(args.model_id))
         print('\tActs                 : {0}'.format(args.acts))
         print('\tRegenerate?          : {0}'.format(args.regenerate))
+        print('\tNew Voices?          : {0}'.format(args.new_voices))
+        print('\tQuery Workers        : {0}'.format(args.query_workers))
+        print('\tStream?              : {0}'.format(args.stream))
+        print('\tTTS Workers          : {0}'.format(args.tts_workers))
+        print('\tSpeaker Silence (s)  : {0}'.format(args.speaker_silence))
+        print('\tTTS Cache (MB)       : {0}'.format('disabled' if args.no_tts_cache else args.tts_cache_size))
+        print('\tLexicon              : {0}'.format(args.lexicon))
+        print('\tRetrieval Results    : {0}'.format(args.retrieval_results))
         print('\tEpisode Number       : {0}'.format(args.episode_number))
+    elif args.action == 'batch':
+        print('\tJobs File            : {0}'.format(args.jobs_file))
+        print('\tModel ID             : {0}'.format(args.model_id))
+        print('\tBatch Episodes       : {0}'.format(args.batch_episodes))
+        print('\tNew Voices?          : {0}'.format(args.new_voices))
+        print('\tQuery Workers        : {0}'.format(args.query_workers))
+        print('\tTTS Workers          : {0}'.format(args.tts_workers))
+        print('\tSpeaker Silence (s)  : {0}'.format(args.speaker_silence))
+        print('\tTTS Cache (MB)       : {0}'.format('disabled' if args.no_tts_cache else args.tts_cache_size))
+        print('\tLexicon              : {0}'.format(args.lexicon))
+        print('\tRetrieval Results    : {0}'.format(args.retrieval_results))
+    print('\tMetrics File         : {0}'.format(args.metrics_file))
+    print('\tProfile              : {0}'.format(args.profile or 'disabled'))
     print('\tDebug Mode           : {0}'.format(args.debug))
     return args
 
-if __name__ == "__main__":
-    args = parse_arguments()
+def create_generator(args, metrics):
+    ttsCache = None if args.no_tts_cache else UtteranceCache(maxBytes=args.tts_cache_size * 1024 * 1024)
+    lexicon = PronunciationLexicon(Generator.PRONUNCIATION_FIXES)
+    if args.lexicon is not None:
+        lexicon.load(args.lexicon)
+    retrievalIndex = None
+    if args.retrieval_results > 0:
+        retrievalIndex = EpisodeIndex(args.index_file)
+        if not retrievalIndex.load():
+            logging.warning('No retrieval index at {0}, prompts are used as given (run the index action to build it)'.format(args.index_file))
+            retrievalIndex = None
+    return Generator(args.api_key, args.model_id, queryWorkers=args.query_workers, apiBase=args.api_base, ttsCache=ttsCache, ttsWorkers=args.tts_workers, speakerSilence=args.speaker_silence, metrics=metrics, lexicon=lexicon, retrievalIndex=retrievalIndex, retrievalResults=args.retrieval_results, newVoices=args.new_voices)
 
-    logging.basicConfig(format='%(levelname)s - %(asctime)s - %(message)s', level=logging.DEBUG if args.debug else logging.INFO, force=True)
+def update_index(args, metrics, rebuild=False):
+    # only episodes missing from the index, or whose corpus entry changed since they were indexed (a refresh scrape), are read and tokenized
+    # returns (index, episodes added, changed episodes indexed again)
+    index = EpisodeIndex(args.index_file)
+    if not rebuild:
+        index.load()
+    corpus = EpisodeCorpus()
+    with metrics.span('index.update'):
+        entryDigests = corpus.entry_digests()
+        changedEpisodes = index.remove(index.changed_episodes(entryDigests))
+        addedEpisodes = index.update(corpus.latest_records(skip=index.episodeNumbers), entryDigests) - changedEpisodes
+    metrics.count('index.added_episodes', addedEpisodes)
+    metrics.count('index.changed_episodes', changedEpisodes)
+    if addedEpisodes or changedEpisodes or rebuild:
+        index.save()
+    return index, addedEpisodes, changedEpisodes
 
+def run_action(args, metrics):
     if args.action == 'scrape':
         print('Running scraper (this may take a while)...')
-        scraper = Scraper()
-        scraper.run(startEpisode=1, endEpisode=args.max_episodes)
+        cache = None if args.no_cache else ResponseCache(ttl=args.cache_ttl * 3600)
+        scraper = Scraper(workers=args.workers, requestsPerSecond=args.requests_per_second, cache=cache, parser=args.html_parser, metrics=metrics)
+        scraper.run(startEpisode=1, endEpisode=args.max_episodes, refresh=args.refresh, json_filename=Scraper.JSON_OUTPUT_FILENAME if args.export_json else None)
         print('Done! Output generated at {0}'.format(scraper.OUTPUT_FILENAME))
+        if not args.no_index:
+            _, addedEpisodes, changedEpisodes = update_index(args, metrics)
+            print('Added {0} episodes to the retrieval index at {1} and updated {2} changed episodes'.format(addedEpisodes, args.index_file, changedEpisodes))
+
+    elif args.action == 'index':
+        print('{0} the retrieval index...'.format('Rebuilding' if args.refresh else 'Updating'))
+        index, addedEpisodes, changedEpisodes = update_index(args, metrics, rebuild=args.refresh)
+        print('Done! Added {0} episodes and updated {1} changed episodes, {2} summaries from {3} episodes indexed at {4}'.format(addedEpisodes, changedEpisodes, len(index), len(index.episodeNumbers), args.index_file))
+
+    elif args.action == 'convert':
+        print('Converting {0} to a line-delimited corpus...'.format(args.json_file))
+        corpus = EpisodeCorpus()
+        episodeCount = corpus.convert_from_json(args.json_file, replace=args.refresh)
+        print('Done! {0} episodes written to {1}'.format(episodeCount, corpus.filename))
 
     elif args.action == 'train':
         print('Running trainer (this may take a while)...')
-        trainer = TAMTrainer()
-        trainer.run(max_training_set=args.max_training_entries)
-        print('Done! Output generated at {0}'.format(trainer.OUTPUT_FILENAME))
+        trainer = TAMTrainer(tokenWorkers=args.token_workers, tokenCache=TokenCountCache(), metrics=metrics)
+        duplicateFilter = None if args.no_dedup else NearDuplicateFilter(threshold=args.dedup_threshold)
+        totalTokens = trainer.run(max_training_set=args.max_training_entries, follow=args.follow, token_budget=args.training_token_budget, duplicate_filter=duplicateFilter)
+        print('Done! Output generated at {0} with {1} training tokens'.format(trainer.OUTPUT_FILENAME, totalTokens))
         print('Now that training data has been created, confirm the data was prepared correctly and then upload it to OpenAI')
         print('1. Prepare: openai tools fine_tunes.prepare_data -f {0}'.format(trainer.OUTPUT_FILENAME))
         print('2. Upload: openai api fine_tunes.create -t {0} -m <BASE_MODEL>'.format(trainer.OUTPUT_FILENAME))
@@ -67,6 +190,47 @@ if __name__ == "__main__":
         if args.prompt is None or args.model_id is None or args.api_key is None or args.episode_number is None:
             logging.error("--api-key, --episode_number, --prompt, and --model-id are required for run action")
             sys.exit(1)
-        generator = Generator(args.api_key, args.model_id)
-        if generator.run(args.prompt, args.episode_number, numberOfActs=args.acts, useExistingData=args.regenerate):
+        generator = create_generator(args, metrics)
+        succeeded = generator.run(args.prompt, args.episode_number, numberOfActs=args.acts, useExistingData=args.regenerate, stream=args.stream)
+        generator.close()
+        if succeeded:
             print('Done! Episode generated at {0}'.format(Generator.EPISODE_FOLDER.format(args.episode_number)))
+
+    elif args.action == 'batch':
+        print('Creating your episodes (this may take a while)...')
+        if args.jobs_file is None or args.model_id is None or args.api_key is None:
+            logging.error("--api-key, --jobs-file, and --model-id are required for batch action")
+            sys.exit(1)
+        generator = create_generator(args, metrics)
+        try:
+            done, failed = BatchRunner(generator, episodesAtOnce=args.batch_episodes).run(args.jobs_file, Generator.EPISODE_FOLDER)
+        finally:
+            generator.close()
+        print('Done! {0} episodes generated in {1} ({2} failed, re-run to retry them)'.format(done, Generator.EPISODE_FOLDER.format('*'), failed))
+        if failed:
+            sys.exit(1)
+
+def run_profiled(args, metrics):
+    # only the main thread is profiled, time in worker threads and processes shows up as waiting
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(run_action, args, metrics)
+    finally:
+        profiler.dump_stats(args.profile)
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(PROFILE_LINES)
+        print('Profile saved to {0} (view it with python -m pstats {0})'.format(args.profile))
+
+if __name__ == "__main__":
+    args = parse_arguments()
+
+    logging.basicConfig(format='%(levelname)s - %(asctime)s - %(message)s', level=logging.DEBUG if args.debug else logging.INFO, force=True)
+
+    metrics = Metrics()
+    try:
+        if args.profile is not None:
+            run_profiled(args, metrics)
+        else:
+            run_action(args, metrics)
+    finally:
+        metrics.save(args.metrics_file)
+        logging.info('Metrics saved to {0}\n{1}'.format(args.metrics_file, metrics.summary()))
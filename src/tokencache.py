@@ -0,0 +1,42 @@
+# remembers token counts between trainer runs so unchanged entries are never tokenized twice
+
+import hashlib
+import json
+import logging
+import os
+
+class TokenCountCache:
+
+    FILENAME = '../token_counts.json'
+
+    def __init__(self, filename=FILENAME):
+        self.filename = filename
+        self.counts = {}
+        self.changed = False
+        if os.path.exists(self.filename):
+            try:
+                with open(self.filename, 'r') as f:
+                    self.counts = json.load(f)
+            except ValueError:
+                logging.warning('Token count cache {0} is unreadable, starting a new one'.format(self.filename))
+
+    def key(self, *parts):
+        # the prompt holds the act name and episode summary and the completion holds the act text
+        return hashlib.sha1('\0'.join(parts).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        return self.counts.get(key)
+
+    def set(self, key, tokenCount):
+        self.counts[key] = tokenCount
+        self.changed = True
+
+    def save(self):
+        if not self.changed:
+            return
+        tmpFilename = self.filename + '.tmp'
+        with open(tmpFilename, 'w') as f:
+            json.dump(self.counts, f)
+        os.replace(tmpFilename, self.filename)
+        self.changed = False
+        logging.debug('Saved {0} token counts to {1}'.format(len(self.counts), self.filename))
@@ -0,0 +1,202 @@
+# builds the fine-tuning set to a token budget, splitting long acts instead of dropping them
+
+from collections import deque, namedtuple
+import bisect
+import logging
+import re
+import time
+
+# a slice [start, end) of one act's text that fits in a single training entry
+TrainingWindow = namedtuple('TrainingWindow', ['episodeKey', 'actId', 'start', 'end', 'tokens'])
+# an episode read during planning, actWindows is None for acts that still have to be tokenized
+PendingEpisode = namedtuple('PendingEpisode', ['episodeKey', 'actIds', 'texts', 'prompts', 'cacheKeys', 'actWindows'])
+
+class TrainingSetBuilder:
+
+    SPLIT_MARGIN = 16 # tokens left free in each window since text can tokenize slightly differently once split
+    TURN_BOUNDARY = re.compile('\n') # each speaker turn is one line of act text
+    CACHE_LABEL = 'windows-v2' # token cache keys of act windows, changed whenever what is stored for a window changes
+
+    def __init__(self, trainer, tokenBudget=None, maxEntries=None, duplicateFilter=None):
+        self.trainer = trainer
+        self.tokenBudget = tokenBudget
+        self.maxEntries = maxEntries
+        self.duplicateFilter = duplicateFilter # NearDuplicateFilter, or None to keep every act
+        self.duplicateTokens = 0
+        self.overhead = None
+        self.plannedActs = 0
+        self.tokenizedActs = 0
+        self.plannedWindows = 0
+        self.plannedTokens = 0
+        self.planSeconds = 0
+
+    def episode_key(self, episodeData):
+        return episodeData['episodeLinkName']
+
+    def cache_label(self):
+        # everything besides the prompt and text that changes an act's windows, so changing a setting never reuses stale spans
+        return '{0} {1} max={2} margin={3} {4!r} {5!r}'.format(
+            self.CACHE_LABEL,
+            self.trainer.TOKENIZER_NAME,
+            self.trainer.MAX_TOKENS,
+            self.SPLIT_MARGIN,
+            self.trainer.COMPLETION_START_TOKEN,
+            self.trainer.COMPLETION_END_TOKEN)
+
+    def completion_overhead(self):
+        # tokens every entry adds around the act text
+        if self.overhead is None:
+            self.overhead = self.trainer.count_tokens(self.trainer.COMPLETION_START_TOKEN + self.trainer.COMPLETION_END_TOKEN)
+        return self.overhead
+
+    def plan(self, scraperData, follow=False):
+        # first pass, returns the windows of every act grouped by episode without keeping any text
+        # acts are tokenized TOKEN_BATCH_SIZE at a time across episodes, episodes are finished in corpus order
+        # when following a scrape, every episode is finished as it arrives and reading stops once the set can be filled
+        batchSize = 1 if follow else self.trainer.TOKEN_BATCH_SIZE
+        episodeWindows = []
+        pendingEpisodes = []
+        pendingTexts = 0
+        for episodeData in scraperData:
+            start = time.perf_counter()
+            pendingEpisodes.append(self.prepare_episode(episodeData))
+            pendingTexts += pendingEpisodes[-1].actWindows.count(None)
+            if pendingTexts >= batchSize or not pendingTexts:
+                episodeWindows.extend(self.finish_episodes(pendingEpisodes))
+                pendingEpisodes = []
+                pendingTexts = 0
+            self.planSeconds += time.perf_counter() - start
+            if follow and self.is_full():
+                logging.info('Planned enough entries, no longer following the scrape')
+                break
+        start = time.perf_counter()
+        episodeWindows.extend(self.finish_episodes(pendingEpisodes))
+        self.planSeconds += time.perf_counter() - start
+        return episodeWindows
+
+    def is_full(self):
+        # true once the planned windows alone can fill the max entries or the token budget
+        if self.maxEntries is not None and self.plannedWindows >= self.maxEntries:
+            return True
+        return self.tokenBudget is not None and self.plannedTokens >= self.tokenBudget
+
+    def prepare_episode(self, episodeData):
+        actIds = list(episodeData['Acts'].keys())
+        prompts = [self.trainer.format_by_episode_prompt(x, episodeData) for x in actIds]
+        texts = [episodeData['Acts'][x]['text'] for x in actIds]
+        tokenCache = self.trainer.tokenCache
+        cacheLabel = self.cache_label()
+        keys = [tokenCache.key(cacheLabel, prompt, text) for prompt, text in zip(prompts, texts)] if tokenCache is not None else [None] * len(actIds)
+        actWindows = [tokenCache.get(x) for x in keys] if tokenCache is not None else [None] * len(actIds)
+        self.plannedActs += len(actIds)
+        return PendingEpisode(self.episode_key(episodeData), actIds, texts, prompts, keys, actWindows)
+
+    def finish_episodes(self, pendingEpisodes):
+        # tokenizes every act still missing windows in one batch, then yields each episode's windows
+        misses = [(episode, i) for episode in pendingEpisodes for i, x in enumerate(episode.actWindows) if x is None]
+        if misses:
+            promptCounts = self.trainer.count_tokens_batch([episode.prompts[i] for episode, i in misses])
+            tokenStarts = self.trainer.token_starts_batch([episode.texts[i] for episode, i in misses])
+            tokenCache = self.trainer.tokenCache
+            for (episode, i), promptTokens, textStarts in zip(misses, promptCounts, tokenStarts):
+                episode.actWindows[i] = self.split_act(episode.texts[i], textStarts, promptTokens)
+                if tokenCache is not None:
+                    tokenCache.set(episode.cacheKeys[i], episode.actWindows[i])
+            self.tokenizedActs += len(misses)
+        for episode in pendingEpisodes:
+            windows = []
+            for actId, text, spans in zip(episode.actIds, episode.texts, episode.actWindows):
+                # collapsed here so duplicates never reach the budget or entry limit
+                if self.duplicateFilter is not None and self.duplicateFilter.is_duplicate('{0} {1}'.format(episode.episodeKey, actId), text):
+                    self.duplicateTokens += sum(x[2] for x in spans)
+                    continue
+                windows.extend(TrainingWindow(episode.episodeKey, actId, start, end, tokens) for start, end, tokens in spans)
+            self.plannedWindows += len(windows)
+            self.plannedTokens += sum(x.tokens for x in windows)
+            yield windows
+
+    def split_act(self, text, tokenStarts, promptTokens):
+        # returns [start, end, tokens] spans of the act text, split between speaker turns where possible
+        # the margin only keeps windows clear of the limit, the tokens reported and budgeted are the real counts
+        limit = self.trainer.MAX_TOKENS - promptTokens - self.completion_overhead() - self.SPLIT_MARGIN
+        if limit <= 0:
+            logging.warning('Prompt alone is over the max of {0} tokens, skipping act: {1}...'.format(self.trainer.MAX_TOKENS, text[:50]))
+            return []
+        tokensBetween = lambda start, end: bisect.bisect_left(tokenStarts, end) - bisect.bisect_left(tokenStarts, start)
+        span = lambda start, end: [start, end, tokensBetween(start, end) + promptTokens + self.completion_overhead()]
+        boundaries = [x.end() for x in self.TURN_BOUNDARY.finditer(text)]
+        if not text.endswith('\n'):
+            boundaries.append(len(text))
+        spans = []
+        windowStart = 0
+        windowEnd = 0
+        for boundary in boundaries:
+            if tokensBetween(windowStart, boundary) <= limit:
+                windowEnd = boundary
+                continue
+            if windowEnd > windowStart:
+                spans.append(span(windowStart, windowEnd))
+                windowStart = windowEnd
+            if tokensBetween(windowStart, boundary) <= limit:
+                windowEnd = boundary
+                continue
+            # a single speaker turn over the limit, so it is split between tokens instead
+            firstToken = bisect.bisect_left(tokenStarts, windowStart)
+            lastToken = bisect.bisect_left(tokenStarts, boundary)
+            for i in range(firstToken, lastToken, limit):
+                start = windowStart if i == firstToken else tokenStarts[i]
+                end = tokenStarts[i + limit] if i + limit < lastToken else boundary
+                spans.append(span(start, end))
+            windowStart = windowEnd = boundary
+        if windowEnd > windowStart:
+            spans.append(span(windowStart, windowEnd))
+        return spans
+
+    def interleave_acts(self, windows):
+        # first window of every act, then the second of every act, etc.
+        byAct = {}
+        for window in windows:
+            byAct.setdefault(window.actId, deque()).append(window)
+        return self.round_robin(list(byAct.values()))
+
+    def round_robin(self, queues):
+        queues = deque(x for x in queues if x)
+        while queues:
+            queue = queues.popleft()
+            yield queue.popleft()
+            if queue:
+                queues.append(queue)
+
+    def select(self, episodeWindows):
+        # takes one window per episode in turn, so a budget is spread over the whole corpus
+        candidates = self.round_robin([deque(self.interleave_acts(x)) for x in episodeWindows])
+        selected = []
+        totalTokens = 0
+        for window in candidates:
+            if self.maxEntries is not None and len(selected) >= self.maxEntries:
+                break
+            if self.tokenBudget is not None and totalTokens + window.tokens > self.tokenBudget:
+                continue
+            selected.append(window)
+            totalTokens += window.tokens
+        return selected, totalTokens
+
+    def build(self, scraperData, selected):
+        # second pass, yields the selected entries in corpus order
+        selectedSpans = {}
+        for window in selected:
+            selectedSpans.setdefault(window.episodeKey, {}).setdefault(window.actId, []).append((window.start, window.end))
+        for episodeData in scraperData:
+            episodeSpans = selectedSpans.pop(self.episode_key(episodeData), {})
+            for actId in episodeData['Acts'].keys():
+                if actId not in episodeSpans:
+                    continue
+                prompt = self.trainer.format_by_episode_prompt(actId, episodeData)
+                text = episodeData['Acts'][actId]['text']
+                for start, end in sorted(episodeSpans[actId]):
+                    yield {
+                        'prompt' : prompt,
+                        'completion' : '{0}{1}{2}'.format(self.trainer.COMPLETION_START_TOKEN, text[start:end], self.trainer.COMPLETION_END_TOKEN)
+                    }
+            if not selectedSpans:
+                return
@@ -0,0 +1,87 @@
+# on-disk cache of synthesized speech, shared across episodes so repeated lines are only synthesized once
+
+from array import array
+import hashlib
+import logging
+import os
+import threading
+
+class UtteranceCache:
+
+    CACHE_FOLDER = '../cache/tts'
+    DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+    EVICT_TO = 0.9 # fraction of max size left after an eviction, so it does not run on every write
+    FILE_EXTENSION = '.f32'
+
+    def __init__(self, folder=CACHE_FOLDER, maxBytes=DEFAULT_MAX_BYTES):
+        self.folder = folder
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(self.folder, exist_ok=True)
+        self.sizeBytes = sum(x.stat().st_size for x in self.entries())
+
+    def entries(self):
+        return [x for x in os.scandir(self.folder) if x.name.endswith(self.FILE_EXTENSION)]
+
+    def key(self, voiceModel, speakerVoice, text):
+        return hashlib.sha256('\0'.join([voiceModel, speakerVoice, text]).encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.folder, key + self.FILE_EXTENSION)
+
+    def get(self, key):
+        # returns the cached samples or None, a hit marks the entry as recently used
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                samples = array('f')
+                samples.frombytes(f.read())
+            os.utime(path)
+        except OSError:
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return samples.tolist()
+
+    def put(self, key, wav):
+        # the model produces float32 samples, so storing them as float32 is lossless
+        data = array('f', wav).tobytes()
+        path = self.path(key)
+        tmpPath = '{0}.{1}.{2}.tmp'.format(path, os.getpid(), threading.get_ident())
+        with open(tmpPath, 'wb') as f:
+            f.write(data)
+        os.replace(tmpPath, path)
+        with self.lock:
+            self.sizeBytes += len(data)
+            if self.sizeBytes > self.maxBytes:
+                self.evict()
+
+    def evict(self):
+        # least recently used entries go first
+        entries = sorted(self.entries(), key=lambda x: x.stat().st_mtime)
+        self.sizeBytes = sum(x.stat().st_size for x in entries)
+        target = self.maxBytes * self.EVICT_TO
+        evicted = 0
+        for entry in entries:
+            if self.sizeBytes <= target:
+                break
+            size = entry.stat().st_size
+            try:
+                os.remove(entry.path)
+            except OSError:
+                continue
+            self.sizeBytes -= size
+            evicted += 1
+        logging.debug('Evicted {0} utterances from the speech cache'.format(evicted))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return 'speech cache {0} hits, {1} misses ({2:.0%} hit rate), {3:.1f} MB used'.format(
+            self.hits,
+            self.misses,
+            self.hits / lookups if lookups else 0,
+            self.sizeBytes / (1024 * 1024))
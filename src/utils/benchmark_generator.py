@@ -0,0 +1,30 @@
+# benchmarks episode querying against the fake completion server, one act at a time against concurrent acts
+
+import argparse
+import os
+import sys
+import time
+
+import fake_completion_server
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from generator import Generator
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Times Generator.query_episode_data offline')
+    parser.add_argument('--acts', type=int, default=4, help='Acts per episode (default 4)')
+    parser.add_argument('--latency', type=float, default=fake_completion_server.DEFAULT_LATENCY, help='Seconds per fake completion (default {0})'.format(fake_completion_server.DEFAULT_LATENCY))
+    parser.add_argument('--failure-rate', type=float, default=0.1, help='Fraction of fake completions that fail with a rate limit error (default 0.1)')
+    parser.add_argument('--query-workers', type=int, default=Generator.DEFAULT_QUERY_WORKERS)
+    args = parser.parse_args()
+
+    server = fake_completion_server.start_server(port=0, latency=args.latency, failureRate=args.failure_rate)
+    Generator.RETRY_BACKOFF = 0.1
+    for queryWorkers in [1, args.query_workers]:
+        generator = Generator('fake-key', 'fake-model', queryWorkers=queryWorkers, apiBase=fake_completion_server.api_base(server))
+        requestsBefore = server.requestCount
+        start = time.perf_counter()
+        episodeData = generator.query_episode_data('An episode on ai written by an ai', numberOfActs=args.acts)
+        elapsed = time.perf_counter() - start
+        print('{0} query workers: {1:.2f} seconds for {2} completions ({3} requests)'.format(queryWorkers, elapsed, len(episodeData) - 1, server.requestCount - requestsBefore))
+    server.shutdown()
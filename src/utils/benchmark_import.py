@@ -0,0 +1,51 @@
+# times cli startup and checks that no heavy library is imported until an action needs it
+# exits non-zero if a heavy module is loaded at import time or startup is slower than --max-seconds
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+SRC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+MODULES = ['thisamericanlifegpt', 'scraper', 'tamtrainer', 'generator', 'dedup', 'corpus', 'responsecache', 'tokencache', 'ttscache', 'trainingsetbuilder']
+HEAVY_MODULES = ['transformers', 'torch', 'TTS', 'openai', 'requests', 'bs4', 'numpy']
+DEFAULT_MAX_SECONDS = 0.5
+DEFAULT_ITERATIONS = 5
+
+def run_in_src(args):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable] + args, cwd=SRC_FOLDER, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+    return elapsed, result.stdout
+
+def heavy_modules_loaded(module):
+    # imports the module in a fresh interpreter and lists which heavy modules came with it
+    check = 'import sys, {0}; print(" ".join(x for x in {1} if x in sys.modules))'.format(module, HEAVY_MODULES)
+    return run_in_src(['-c', check])[1].split()
+
+def best_time(args, iterations):
+    return min(run_in_src(args)[0] for _ in range(iterations))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Times cli startup and checks for heavy imports')
+    parser.add_argument('--iterations', type=int, default=DEFAULT_ITERATIONS, help='Runs per measurement, the fastest is reported (default {0})'.format(DEFAULT_ITERATIONS))
+    parser.add_argument('--max-seconds', type=float, default=DEFAULT_MAX_SECONDS, help='Fails if --help takes longer than this (default {0})'.format(DEFAULT_MAX_SECONDS))
+    args = parser.parse_args()
+
+    failed = False
+    baseline = best_time(['-c', 'pass'], args.iterations)
+    print('{0:<20} {1:>8}  {2}'.format('module', 'seconds', 'heavy imports'))
+    for module in MODULES:
+        seconds = best_time(['-c', 'import {0}'.format(module)], args.iterations) - baseline
+        heavy = heavy_modules_loaded(module)
+        failed = failed or bool(heavy)
+        print('{0:<20} {1:>8.3f}  {2}'.format(module, seconds, ' '.join(heavy) or '-'))
+    helpSeconds = best_time(['thisamericanlifegpt.py', '--help'], args.iterations)
+    print('thisamericanlifegpt.py --help took {0:.3f} seconds (interpreter startup {1:.3f})'.format(helpSeconds, baseline))
+    if helpSeconds > args.max_seconds:
+        print('--help is slower than {0} seconds'.format(args.max_seconds))
+        failed = True
+    sys.exit(1 if failed else 0)
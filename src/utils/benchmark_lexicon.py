@@ -0,0 +1,58 @@
+# benchmarks pronunciation fixes on the fixture transcript: one str.replace per entry against the one-pass lexicon
+
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+from fixturepages import FixtureScraper
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from generator import Generator
+from lexicon import PronunciationLexicon
+import script
+
+def random_entries(count, seed=1):
+    # made up names of the length of real guest and place names
+    generator = random.Random(seed)
+    entries = dict(Generator.PRONUNCIATION_FIXES)
+    while len(entries) < count:
+        word = generator.choice(string.ascii_uppercase) + ''.join(generator.choice(string.ascii_lowercase) for _ in range(generator.randint(3, 10)))
+        entries[word] = word.lower()
+    return entries
+
+def replace_each(entries, text):
+    # how Generator.change_pronunciation worked before the lexicon
+    for word, pronunciation in entries.items():
+        if word in text:
+            text = text.replace(word, pronunciation)
+    return text
+
+def utterances_per_second(fix, texts):
+    start = time.perf_counter()
+    for text in texts:
+        fix(text)
+    return len(texts) / (time.perf_counter() - start)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compares utterances/sec for pronunciation fixes by lexicon size')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[6, 100, 1000, 10000], help='Lexicon sizes to time (default 6 100 1000 10000)')
+    args = parser.parse_args()
+
+    episodeData = FixtureScraper().parse(1)
+    texts = [x.text for act in episodeData['Acts'].values() for x in script.parse_lines(act['text'])]
+    print('{0:>8} {1:>16} {2:>16} {3:>12}'.format('entries', 'replace/sec', 'lexicon/sec', 'compile sec'))
+    for size in args.sizes:
+        entries = random_entries(size)
+        lexicon = PronunciationLexicon(entries)
+        start = time.perf_counter()
+        lexicon.apply('')
+        lexicon.apply('compiles the pattern')
+        compileSeconds = time.perf_counter() - start
+        print('{0:>8} {1:>16.0f} {2:>16.0f} {3:>12.3f}'.format(
+            size,
+            utterances_per_second(lambda x: replace_each(entries, x), texts),
+            utterances_per_second(lexicon.apply, texts),
+            compileSeconds))
@@ -0,0 +1,34 @@
+# benchmarks scraper page parsing on the saved fixture pages for each available parser backend
+
+import argparse
+import importlib.util
+import time
+
+from fixturepages import FixtureScraper, load_fixtures
+
+def benchmark(parser, partialParse, fixtures, iterations):
+    scraper = FixtureScraper(fixtures=fixtures, parser=parser, partialParse=partialParse)
+    pagesPerEpisode = 2 + len(scraper.parse(1)['Acts']) # transcript, summary and one page per act summary
+    start = time.perf_counter()
+    for _ in range(iterations):
+        scraper.parse(1)
+    elapsed = time.perf_counter() - start
+    return iterations * pagesPerEpisode / elapsed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compares pages/sec across html parser backends')
+    parser.add_argument('--iterations', type=int, default=50, help='Episodes parsed per backend (default 50)')
+    args = parser.parse_args()
+
+    fixtures = load_fixtures()
+    reference = FixtureScraper(fixtures=fixtures, parser='html.parser', partialParse=False).parse(1)
+    print('{0:<12} {1:<8} {2:>10}'.format('backend', 'tree', 'pages/sec'))
+    for backend in FixtureScraper.PARSER_BACKENDS:
+        if backend != FixtureScraper.SOUP_PARSER and importlib.util.find_spec(backend) is None:
+            print('{0:<12} not installed, skipping'.format(backend))
+            continue
+        for partialParse in [False, True]:
+            if FixtureScraper(fixtures=fixtures, parser=backend, partialParse=partialParse).parse(1) != reference:
+                print('WARNING: {0} ({1}) does not match html.parser output'.format(backend, 'partial' if partialParse else 'full'))
+            pagesPerSecond = benchmark(backend, partialParse, fixtures, args.iterations)
+            print('{0:<12} {1:<8} {2:>10.1f}'.format(backend, 'partial' if partialParse else 'full', pagesPerSecond))
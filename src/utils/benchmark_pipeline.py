@@ -0,0 +1,186 @@
+# benchmarks the whole pipeline offline: scraping, training set building and episode generation
+# every external service is replaced by a local stand-in, results are written as json to compare commits
+
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import fake_completion_server
+import fixture_server
+from offline_stubs import StubTokenizer, StubVoiceModel
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from corpus import EpisodeCorpus
+from generator import Generator
+from scraper import Scraper
+from tamtrainer import TAMTrainer
+
+DEFAULT_OUTPUT = 'benchmark_results.json'
+
+class TimedScraper(Scraper):
+    # records how long each episode takes from its first request to its last parse
+
+    def __init__(self, sourceUrl, **kwargs):
+        super().__init__(**kwargs)
+        self.SOURCE_URL = sourceUrl
+        self.episodeSeconds = []
+
+    def parse(self, curEpisode):
+        start = time.perf_counter()
+        episodeData = super().parse(curEpisode)
+        self.episodeSeconds.append(time.perf_counter() - start)
+        return episodeData
+
+def latency_stats(seconds):
+    if not seconds:
+        return None
+    ordered = sorted(seconds)
+    percentile = lambda p: ordered[min(len(ordered) - 1, int(round(p * (len(ordered) - 1))))]
+    return {
+        'mean' : sum(ordered) / len(ordered),
+        'p50' : percentile(0.5),
+        'p95' : percentile(0.95),
+        'max' : ordered[-1]
+    }
+
+def per_second(count, seconds):
+    return count / seconds if seconds else 0
+
+def benchmark_scrape(args, corpusFilename):
+    server = fixture_server.start_server(port=0, latency=args.page_latency)
+    scraper = TimedScraper(fixture_server.base_url(server), workers=args.workers, requestsPerSecond=0)
+    start = time.perf_counter()
+    scraper.run(startEpisode=1, endEpisode=args.episodes, output_filename=corpusFilename)
+    seconds = time.perf_counter() - start
+    server.shutdown()
+    episodes = len(EpisodeCorpus(corpusFilename).episode_numbers())
+    return {
+        'seconds' : seconds,
+        'episodes' : episodes,
+        'pages' : server.requestCount,
+        'bytes' : server.bytesSent,
+        'pages_per_sec' : per_second(server.requestCount, seconds),
+        'episodes_per_sec' : per_second(episodes, seconds),
+        'episode_latency' : latency_stats(scraper.episodeSeconds),
+        'metrics' : scraper.metrics.to_dict()
+    }
+
+def benchmark_train(args, corpusFilename, trainingFilename):
+    trainer = TAMTrainer(tokenWorkers=1)
+    start = time.perf_counter()
+    totalTokens = trainer.run(filename=trainingFilename, max_training_set=sys.maxsize, scraper_filename=corpusFilename)
+    seconds = time.perf_counter() - start
+    with open(trainingFilename, 'r') as f:
+        entries = sum(1 for _ in f)
+    return {
+        'seconds' : seconds,
+        'entries' : entries,
+        'tokens' : totalTokens,
+        'entries_per_sec' : per_second(entries, seconds),
+        'tokens_per_sec' : per_second(totalTokens, seconds),
+        'metrics' : trainer.metrics.to_dict()
+    }
+
+def benchmark_generate(args, episodeFolder):
+    server = fake_completion_server.start_server(port=0, latency=args.completion_latency)
+    voiceModel = StubVoiceModel(latency=args.tts_latency)
+    generator = Generator('fake-key', 'fake-model', queryWorkers=args.query_workers, apiBase=fake_completion_server.api_base(server), tts=voiceModel)
+    episodeSeconds = []
+    failed = 0
+    start = time.perf_counter()
+    for episodeNumber in range(1, args.generate_episodes + 1):
+        episodeStart = time.perf_counter()
+        if not generator.run('An episode on ai written by an ai', episodeNumber, numberOfActs=args.acts, episodeFolder=episodeFolder, stream=args.stream):
+            failed += 1
+        episodeSeconds.append(time.perf_counter() - episodeStart)
+    seconds = time.perf_counter() - start
+    generator.close()
+    server.shutdown()
+    audioSeconds = voiceModel.samples / voiceModel.synthesizer.output_sample_rate
+    return {
+        'seconds' : seconds,
+        'episodes' : args.generate_episodes - failed,
+        'failed' : failed,
+        'completions' : server.requestCount,
+        'utterances' : voiceModel.utterances,
+        'audio_seconds' : audioSeconds,
+        'completions_per_sec' : per_second(server.requestCount, seconds),
+        'utterances_per_sec' : per_second(voiceModel.utterances, seconds),
+        'episode_latency' : latency_stats(episodeSeconds),
+        'metrics' : generator.metrics.to_dict()
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_results(stages):
+    throughputs = {
+        'scrape' : ('pages_per_sec', 'pages/sec'),
+        'train' : ('entries_per_sec', 'entries/sec'),
+        'generate' : ('utterances_per_sec', 'utterances/sec')
+    }
+    print('{0:<10} {1:>9} {2:>22} {3:>16}'.format('stage', 'seconds', 'throughput', 'p95 latency'))
+    for stage, result in stages.items():
+        key, unit = throughputs[stage]
+        latency = result.get('episode_latency')
+        print('{0:<10} {1:>9.2f} {2:>22} {3:>16}'.format(
+            stage,
+            result['seconds'],
+            '{0:.1f} {1}'.format(result[key], unit),
+            '-' if latency is None else '{0:.3f} s/episode'.format(latency['p95'])))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Runs the pipeline against local stand-ins and reports per-stage throughput')
+    parser.add_argument('--episodes', type=int, default=20, help='Episodes scraped and trained on (default 20)')
+    parser.add_argument('--workers', type=int, default=4, help='Scraper workers (default 4)')
+    parser.add_argument('--page-latency', type=float, default=fixture_server.DEFAULT_LATENCY, help='Seconds per fixture page (default {0})'.format(fixture_server.DEFAULT_LATENCY))
+    parser.add_argument('--generate-episodes', type=int, default=2, help='Episodes generated (default 2)')
+    parser.add_argument('--acts', type=int, default=2, help='Acts per generated episode (default 2)')
+    parser.add_argument('--query-workers', type=int, default=Generator.DEFAULT_QUERY_WORKERS)
+    parser.add_argument('--completion-latency', type=float, default=0.5, help='Seconds per fake completion (default 0.5)')
+    parser.add_argument('--tts-latency', type=float, default=0.01, help='Seconds the stub voice model spends per utterance (default 0.01)')
+    parser.add_argument('--stream', action='store_true', default=False, help='Generates episodes with --stream')
+    parser.add_argument('--real-tokenizer', action='store_true', default=False, help='Uses the gpt2 tokenizer instead of the stub, it must already be downloaded')
+    parser.add_argument('--stages', nargs='+', choices=['scrape', 'train', 'generate'], default=['scrape', 'train', 'generate'])
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='Json results file (default {0})'.format(DEFAULT_OUTPUT))
+    parser.add_argument('--debug', action='store_true', default=False)
+    args = parser.parse_args()
+    logging.basicConfig(format='%(levelname)s - %(message)s', level=logging.DEBUG if args.debug else logging.ERROR)
+
+    if not args.real_tokenizer:
+        TAMTrainer.loadedTokenizers[TAMTrainer.TOKENIZER_NAME] = StubTokenizer()
+    stages = {}
+    with tempfile.TemporaryDirectory() as folder:
+        corpusFilename = os.path.join(folder, 'episodes.jsonl')
+        if 'scrape' in args.stages or 'train' in args.stages:
+            # training always needs a corpus, so it is scraped even when only training is measured
+            scrapeResult = benchmark_scrape(args, corpusFilename)
+            if 'scrape' in args.stages:
+                stages['scrape'] = scrapeResult
+        if 'train' in args.stages:
+            stages['train'] = benchmark_train(args, corpusFilename, os.path.join(folder, 'training_data.jsonl'))
+        if 'generate' in args.stages:
+            stages['generate'] = benchmark_generate(args, os.path.join(folder, 'episode {0}'))
+
+    results = {
+        'commit' : git_commit(),
+        'timestamp' : time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python' : platform.python_version(),
+        'platform' : platform.platform(),
+        'cpus' : os.cpu_count(),
+        'settings' : vars(args),
+        'stages' : stages
+    }
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=4)
+    print_results(stages)
+    print('Results written to {0}'.format(args.output))
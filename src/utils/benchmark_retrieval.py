@@ -0,0 +1,71 @@
+# benchmarks the retrieval index on made up summaries: build, incremental update, load and top-k query times against a scan of every summary
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+
+from fixturepages import FixtureScraper
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from retrieval import EpisodeIndex
+
+def random_records(count, words, start=1, seed=1):
+    # episodes shaped like the scraped ones, with summaries of words from the fixture transcript
+    generator = random.Random(seed + start)
+    summary = lambda: ' '.join(generator.choice(words) for _ in range(generator.randint(20, 80)))
+    for episodeNumber in range(start, start + count):
+        acts = {'act{0}'.format(i) : {'name' : 'Act {0}'.format(i), 'summary' : summary()} for i in range(1, 4)}
+        yield episodeNumber, {'episodeName' : 'Episode {0}'.format(episodeNumber), 'summary' : summary(), 'Acts' : acts}
+
+def scan(index, query, k):
+    # what a search costs without the index, every summary is tokenized and counted again
+    queryTerms = set(index.tokenize(query))
+    scores = []
+    for i, document in enumerate(index.documents):
+        counts = Counter(index.tokenize(document[3]))
+        scores.append((sum(counts[x] for x in queryTerms), i))
+    return sorted(scores, reverse=True)[:k]
+
+def milliseconds(function, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function()
+    return (time.perf_counter() - start) * 1000 / repeats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Times the bm25 retrieval index against scanning every summary')
+    parser.add_argument('--episodes', type=int, default=1000, help='Episodes indexed (default 1000, about what the site has)')
+    parser.add_argument('--new-episodes', type=int, default=10, help='Episodes added by the incremental update (default 10)')
+    parser.add_argument('--results', type=int, default=EpisodeIndex.DEFAULT_RESULTS, help='Summaries returned per query (default {0})'.format(EpisodeIndex.DEFAULT_RESULTS))
+    parser.add_argument('--queries', type=int, default=200, help='Queries timed (default 200)')
+    args = parser.parse_args()
+
+    episodeData = FixtureScraper().parse(1)
+    words = sorted(set(EpisodeIndex.WORD_PATTERN.findall(' '.join(x['text'] for x in episodeData['Acts'].values()))))
+    generator = random.Random(0)
+    queries = [' '.join(generator.choice(words) for _ in range(generator.randint(3, 15))) for _ in range(args.queries)]
+
+    with tempfile.TemporaryDirectory() as folder:
+        filename = os.path.join(folder, 'episodes.npz')
+        index = EpisodeIndex(filename)
+        start = time.perf_counter()
+        index.update(random_records(args.episodes, words))
+        index.save()
+        print('Built {0} summaries from {1} episodes in {2:.0f} ms ({3:.1f} MB)'.format(
+            len(index), args.episodes, (time.perf_counter() - start) * 1000, os.path.getsize(filename) / (1024 * 1024)))
+
+        start = time.perf_counter()
+        index = EpisodeIndex(filename)
+        index.load()
+        index.update(random_records(args.new_episodes, words, start=args.episodes + 1))
+        index.save()
+        print('Loaded, added {0} episodes and saved in {1:.0f} ms'.format(args.new_episodes, (time.perf_counter() - start) * 1000))
+
+        queryIterator = iter(queries * 2)
+        print('Index query {0:.3f} ms, scan {1:.3f} ms'.format(
+            milliseconds(lambda: index.search(next(queryIterator), args.results), len(queries)),
+            milliseconds(lambda: scan(index, next(queryIterator), args.results), len(queries))))
@@ -0,0 +1,54 @@
+# benchmarks speech synthesis with one process against a pool of voice model processes and checks both write the same audio
+# uses the real voice model, so TTS must be installed and the model downloaded
+
+import argparse
+import filecmp
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from fixturepages import FixtureScraper
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from generator import Generator
+
+def fixture_episode_data(lines):
+    # the first lines of the fixture transcript, in the completion format the generator reads
+    text = ''.join(x['text'] for x in FixtureScraper().parse(1)['Acts'].values())
+    return [{'choices' : [{'text' : '\n'.join(text.splitlines()[:lines]) + '\n'}]}]
+
+def produce(ttsWorkers, episodeData, outputFolder):
+    # returns (seconds, lines synthesized), without the speech cache so every line is synthesized
+    generator = Generator('fake-key', 'fake-model', ttsWorkers=ttsWorkers)
+    generator.load_voices() # the model loads before the timing starts
+    start = time.perf_counter()
+    generator.produce_episode(episodeData, outputFolder)
+    seconds = time.perf_counter() - start
+    generator.close()
+    return seconds, generator.metrics.counters.get('tts.utterances', 0)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compares serial and parallel speech synthesis and fails if their audio differs')
+    parser.add_argument('--lines', type=int, default=40, help='Transcript lines synthesized (default 40)')
+    parser.add_argument('--tts-workers', type=int, default=os.cpu_count(), help='Processes for the parallel run (default cpu count)')
+    args = parser.parse_args()
+
+    episodeData = fixture_episode_data(args.lines)
+    with tempfile.TemporaryDirectory() as folder:
+        serialFolder = os.path.join(folder, 'serial')
+        parallelFolder = os.path.join(folder, 'parallel')
+        os.makedirs(serialFolder)
+        os.makedirs(parallelFolder)
+        serialSeconds, utterances = produce(1, episodeData, serialFolder)
+        # the parallel run reuses the serial run's voices, so any difference comes from synthesis
+        shutil.copyfile(Generator.VOICES_FILENAME.format(serialFolder), Generator.VOICES_FILENAME.format(parallelFolder))
+        parallelSeconds, _ = produce(args.tts_workers, episodeData, parallelFolder)
+        identical = filecmp.cmp(os.path.join(serialFolder, 'audio.wav'), os.path.join(parallelFolder, 'audio.wav'), shallow=False)
+    print('{0} lines'.format(utterances))
+    print('{0:<24} {1:>8.2f} seconds'.format('1 process', serialSeconds))
+    print('{0:<24} {1:>8.2f} seconds ({2:.2f}x)'.format('{0} processes'.format(args.tts_workers), parallelSeconds, serialSeconds / parallelSeconds if parallelSeconds else 0))
+    print('Audio {0}'.format('identical' if identical else 'DIFFERS between serial and parallel synthesis'))
+    if not identical:
+        sys.exit(1)
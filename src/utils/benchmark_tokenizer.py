@@ -0,0 +1,56 @@
+# benchmarks training set planning: acts tokenized one episode at a time against batched across episodes, pooled and cached
+
+import argparse
+import copy
+import os
+import sys
+import tempfile
+import time
+
+from fixturepages import FixtureScraper
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from tamtrainer import TAMTrainer
+from tokencache import TokenCountCache
+from trainingsetbuilder import TrainingSetBuilder
+
+def fixture_episodes(episodes):
+    episodeData = FixtureScraper().parse(1)
+    for i in range(episodes):
+        # a different summary per episode so every act is tokenized
+        episode = copy.deepcopy(episodeData)
+        episode['summary'] = 'Fixture episode number {0}'.format(i)
+        episode['episodeLinkName'] = '/{0}/fixture-episode'.format(i)
+        yield episode
+
+def acts_per_second(trainer, episodes):
+    builder = TrainingSetBuilder(trainer)
+    start = time.perf_counter()
+    windows = builder.plan(fixture_episodes(episodes))
+    seconds = time.perf_counter() - start
+    return builder.plannedActs / seconds, sum(len(x) for x in windows)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compares acts/sec for planning the training set')
+    parser.add_argument('--episodes', type=int, default=50, help='Fixture episodes to plan (default 50)')
+    parser.add_argument('--token-workers', type=int, default=os.cpu_count(), help='Processes for the pooled run (default cpu count)')
+    args = parser.parse_args()
+
+    trainer = TAMTrainer()
+    trainer.tokenizer # loaded up front so it is not timed
+    results = []
+    perEpisodeTrainer = TAMTrainer()
+    perEpisodeTrainer.TOKEN_BATCH_SIZE = 1 # each episode is tokenized as soon as it is read
+    results.append(('one episode at a time', acts_per_second(perEpisodeTrainer, args.episodes)))
+    results.append(('batched', acts_per_second(trainer, args.episodes)))
+    pooledTrainer = TAMTrainer(tokenWorkers=args.token_workers)
+    pooledTrainer.count_tokens_batch(['starts the workers'] * args.token_workers)
+    results.append(('batched, {0} processes'.format(args.token_workers), acts_per_second(pooledTrainer, args.episodes)))
+    pooledTrainer.close()
+    with tempfile.TemporaryDirectory() as folder:
+        cachedTrainer = TAMTrainer(tokenCache=TokenCountCache(os.path.join(folder, 'token_counts.json')))
+        acts_per_second(cachedTrainer, args.episodes)
+        results.append(('memoized re-run', acts_per_second(cachedTrainer, args.episodes)))
+    print('{0} episodes'.format(args.episodes))
+    for name, (actsPerSecond, windows) in results:
+        print('{0:<24} {1:>10.1f} acts/sec ({2} entries)'.format(name, actsPerSecond, windows))
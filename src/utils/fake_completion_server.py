@@ -0,0 +1,110 @@
+# local stand-in for the openai completions endpoint so generation can be tested and benchmarked offline
+# point the generator at it with --api-base http://127.0.0.1:<PORT>/v1
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_PORT = 8911
+DEFAULT_LATENCY = 1.0 # seconds per completion
+COMPLETION_TEXT = (
+    'IRA GLASS : From WBEZ Chicago, it\'s This American Life. I\'m Ira Glass.\n'
+    '[MUSIC]\n'
+    'REPORTER : It started, like most of these stories do, with a phone call.\n'
+    'GUEST : I didn\'t think anything of it at first: it was just a number I didn\'t know.\n'
+    'IRA GLASS : Stay with us.\n'
+)
+
+class FakeCompletionHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        self.server.requestCount += 1
+        if not request.get('stream'):
+            time.sleep(self.server.latency)
+        if random.random() < self.server.failureRate:
+            self.send_json(429, {'error' : {'message' : 'Rate limit reached (fake)', 'type' : 'requests', 'code' : None, 'param' : None}}, {'Retry-After' : '0'})
+            return
+        if request.get('stream'):
+            self.send_stream(self.completion(request))
+        else:
+            self.send_json(200, self.completion(request))
+
+    def send_stream(self, completion):
+        # server-sent events, one chunk per word spread over the latency, as the real endpoint streams
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        self.close_connection = True
+        words = completion['choices'][0]['text'].split(' ')
+        try:
+            for i, word in enumerate(words):
+                chunk = dict(completion, choices=[{'text' : word if i == 0 else ' ' + word, 'index' : 0, 'logprobs' : None, 'finish_reason' : None}])
+                chunk.pop('usage')
+                self.wfile.write('data: {0}\n\n'.format(json.dumps(chunk)).encode('utf-8'))
+                self.wfile.flush()
+                time.sleep(self.server.streamInterval)
+            self.wfile.write(b'data: [DONE]\n\n')
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass # client stopped reading
+
+    def completion(self, request):
+        promptTokens = len(str(request.get('prompt', '')).split())
+        return {
+            'id' : 'cmpl-fake{0}'.format(self.server.requestCount),
+            'object' : 'text_completion',
+            'created' : int(time.time()),
+            'model' : request.get('model', 'fake'),
+            'choices' : [{'text' : self.server.completionText, 'index' : 0, 'logprobs' : None, 'finish_reason' : 'stop'}],
+            'usage' : {
+                'prompt_tokens' : promptTokens,
+                'completion_tokens' : len(self.server.completionText.split()),
+                'total_tokens' : promptTokens + len(self.server.completionText.split())
+            }
+        }
+
+    def send_json(self, status, body, headers={}):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+def start_server(port=DEFAULT_PORT, latency=DEFAULT_LATENCY, failureRate=0, completionText=COMPLETION_TEXT):
+    # serves on a background thread, returns the server so the caller can shutdown() it
+    server = ThreadingHTTPServer(('127.0.0.1', port), FakeCompletionHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.streamInterval = latency / max(1, len(completionText.split(' ')))
+    server.failureRate = failureRate
+    server.completionText = completionText
+    server.requestCount = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def api_base(server):
+    return 'http://127.0.0.1:{0}/v1'.format(server.server_address[1])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Fake openai completion server')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--latency', type=float, default=DEFAULT_LATENCY, help='Seconds before each completion is returned (default {0})'.format(DEFAULT_LATENCY))
+    parser.add_argument('--failure-rate', type=float, default=0, help='Fraction of requests answered with a 429 rate limit error')
+    args = parser.parse_args()
+    server = start_server(args.port, args.latency, args.failure_rate)
+    print('Serving fake completions at {0}'.format(api_base(server)))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
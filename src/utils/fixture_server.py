@@ -0,0 +1,56 @@
+# local stand-in for thisamericanlife.org that serves the saved fixture pages for any episode
+# point a scraper at it by setting its SOURCE_URL to base_url(server)
+
+import argparse
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from fixturepages import fixture_page_for_path, load_fixtures
+
+DEFAULT_PORT = 8912
+DEFAULT_LATENCY = 0.05 # seconds per page
+
+class FixturePageHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        data = self.server.fixtures[fixture_page_for_path(self.path)]
+        with self.server.countLock:
+            self.server.requestCount += 1
+            self.server.bytesSent += len(data)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+def start_server(port=DEFAULT_PORT, latency=DEFAULT_LATENCY, fixtures=None):
+    # serves on a background thread, returns the server so the caller can shutdown() it
+    server = ThreadingHTTPServer(('127.0.0.1', port), FixturePageHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.fixtures = fixtures if fixtures is not None else load_fixtures()
+    server.requestCount = 0
+    server.bytesSent = 0
+    server.countLock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def base_url(server):
+    return 'http://127.0.0.1:{0}/'.format(server.server_address[1])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serves the fixture pages as a fake thisamericanlife.org')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--latency', type=float, default=DEFAULT_LATENCY, help='Seconds before each page is returned (default {0})'.format(DEFAULT_LATENCY))
+    args = parser.parse_args()
+    server = start_server(args.port, args.latency)
+    print('Serving fixture pages at {0}'.format(base_url(server)))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,36 @@
+# saved thisamericanlife.org pages so the scraper can be run without the site
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from scraper import Scraper
+
+FIXTURE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+FIXTURE_PAGES = ['transcript', 'episode', 'act']
+
+def load_fixtures(folder=FIXTURE_FOLDER):
+    fixtures = {}
+    for page in FIXTURE_PAGES:
+        with open(os.path.join(folder, page + '.html'), 'rb') as f:
+            fixtures[page] = f.read()
+    return fixtures
+
+def fixture_page_for_path(path):
+    # /1/transcript -> transcript, /1/fixture-episode -> episode, /1/fixture-episode/act1 -> act
+    parts = [x for x in path.split('?')[0].split('/') if x]
+    if parts and parts[-1] == 'transcript':
+        return 'transcript'
+    if len(parts) >= 3:
+        return 'act'
+    return 'episode'
+
+class FixtureScraper(Scraper):
+    # serves every page from the fixtures instead of the network
+
+    def __init__(self, fixtures=None, **kwargs):
+        super().__init__(**kwargs)
+        self.fixtures = fixtures if fixtures is not None else load_fixtures()
+
+    def fetch(self, url):
+        return self.fixtures[fixture_page_for_path(url[len(self.SOURCE_URL):])]
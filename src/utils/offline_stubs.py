@@ -0,0 +1,57 @@
+# stand-ins for the gpt2 tokenizer and the coqui voice model, so the pipeline runs without downloading either
+# both are deterministic, the same input always gives the same tokens and the same audio
+
+import math
+import re
+import time
+import zlib
+
+import numpy as np
+
+class StubTokenizer:
+    # splits text roughly like gpt2's pre-tokenizer, counts are close enough to real ones to exercise token budgets
+
+    PATTERN = re.compile(r"'s|'t|'re|'ve|'m|'ll|'d| ?\w+| ?[^\s\w]+|\s+(?!\S)|\s+")
+    VOCAB_SIZE = 50257
+
+    def __call__(self, text, return_offsets_mapping=False):
+        if isinstance(text, str):
+            ids, offsets = self.encode(text)
+        else:
+            encoded = [self.encode(x) for x in text]
+            ids = [x[0] for x in encoded]
+            offsets = [x[1] for x in encoded]
+        result = {'input_ids' : ids}
+        if return_offsets_mapping:
+            result['offset_mapping'] = offsets
+        return result
+
+    def encode(self, text):
+        matches = list(self.PATTERN.finditer(text))
+        ids = [zlib.crc32(x.group().encode('utf-8')) % self.VOCAB_SIZE for x in matches]
+        return ids, [x.span() for x in matches]
+
+class StubSynthesizer:
+    output_sample_rate = 22050
+
+class StubVoiceModel:
+    # has the parts of TTS.api.TTS that Generator uses, audio is a tone whose length follows the text
+
+    SECONDS_PER_CHARACTER = 0.06 # about the pace of the real voices
+
+    def __init__(self, latency=0):
+        self.speakers = ['p{0}'.format(x) for x in range(225, 377)] + ['ED\n']
+        self.synthesizer = StubSynthesizer()
+        self.latency = latency # seconds spent per utterance, to stand in for model compute
+        self.utterances = 0
+        self.samples = 0
+
+    def tts(self, text, speaker=None):
+        if self.latency:
+            time.sleep(self.latency)
+        frames = int(len(text) * self.SECONDS_PER_CHARACTER * self.synthesizer.output_sample_rate)
+        pitch = 100 + zlib.crc32(str(speaker).encode('utf-8')) % 200
+        wav = 0.5 * np.sin(np.arange(frames, dtype=np.float32) * (2 * math.pi * pitch / self.synthesizer.output_sample_rate))
+        self.utterances += 1
+        self.samples += frames
+        return wav.astype(np.float32).tolist()
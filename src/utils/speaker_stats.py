@@ -0,0 +1,36 @@
+# lists who speaks most across the scraped corpus, useful when picking which speakers get fixed voices
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from corpus import EpisodeCorpus
+import script
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', EpisodeCorpus.FILENAME)
+
+def act_texts(corpus):
+    for episodeData in corpus.episodes():
+        for act in episodeData['Acts'].values():
+            yield act['text']
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Counts lines and words per speaker across the scraped corpus')
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS, help='Line-delimited episode corpus (default {0})'.format(EpisodeCorpus.FILENAME))
+    parser.add_argument('--top', type=int, default=25, help='Speakers listed (default 25)')
+    args = parser.parse_args()
+
+    texts = list(act_texts(EpisodeCorpus(args.corpus)))
+    start = time.perf_counter()
+    statistics = script.speaker_statistics(texts)
+    seconds = time.perf_counter() - start
+    print('{0:<30} {1:>8} {2:>10}'.format('speaker', 'lines', 'words'))
+    for speaker, lines, words in statistics[:args.top]:
+        print('{0:<30} {1:>8} {2:>10}'.format(speaker, lines, words))
+    print('Parsed {0} acts ({1:.1f} MB) in {2:.2f} seconds, {3} speakers'.format(
+        len(texts),
+        sum(len(x) for x in texts) / (1024 * 1024),
+        seconds,
+        len(statistics)))
@@ -0,0 +1,70 @@
+# writes episode audio to disk as it is synthesized, so memory stays flat however long the episode is
+
+import logging
+import wave
+
+import numpy as np
+
+class StreamingWavWriter:
+
+    SAMPLE_WIDTH = 2 # bytes, 16-bit pcm like the voice model's own save_wav
+    MAX_AMPLITUDE = 32767
+    MIN_PEAK = 0.01 # same floor save_wav uses so near-silent audio is not blown up
+    CHUNK_FRAMES = 1 << 18 # frames handled at once for silence and normalization
+    HEADER_BYTES = 44 # wave always writes a plain riff/fmt/data header for pcm
+
+    def __init__(self, filename, sampleRate, normalize=True):
+        self.filename = filename
+        self.sampleRate = sampleRate
+        self.normalize = normalize
+        self.peak = 0.0
+        self.frames = 0
+        self.wav = wave.open(filename, 'wb')
+        self.wav.setnchannels(1)
+        self.wav.setsampwidth(self.SAMPLE_WIDTH)
+        self.wav.setframerate(sampleRate)
+
+    def write(self, samples):
+        samples = np.asarray(samples, dtype=np.float32)
+        if samples.size == 0:
+            return
+        self.peak = max(self.peak, float(np.max(np.abs(samples))))
+        pcm = (np.clip(samples, -1.0, 1.0) * self.MAX_AMPLITUDE).astype(np.int16)
+        self.wav.writeframes(pcm.tobytes())
+        self.frames += samples.size
+
+    def write_silence(self, seconds):
+        remaining = int(round(seconds * self.sampleRate))
+        while remaining > 0:
+            frames = min(remaining, self.CHUNK_FRAMES)
+            self.wav.writeframes(bytes(frames * self.SAMPLE_WIDTH))
+            self.frames += frames
+            remaining -= frames
+
+    def seconds(self):
+        return self.frames / self.sampleRate
+
+    def close(self):
+        # wave fills in the final sizes in the header when it is closed
+        self.wav.close()
+        if self.peak > 1.0:
+            logging.warning('Audio peaked at {0:.2f} and was clipped'.format(self.peak))
+        if self.normalize and 0 < self.peak < 1.0:
+            self.scale_in_place(1.0 / max(self.MIN_PEAK, self.peak))
+
+    def scale_in_place(self, scale):
+        # louder to full scale like save_wav, one chunk of the file at a time
+        chunkBytes = self.CHUNK_FRAMES * self.SAMPLE_WIDTH
+        with open(self.filename, 'r+b') as f:
+            position = self.HEADER_BYTES
+            remaining = self.frames * self.SAMPLE_WIDTH
+            while remaining > 0:
+                f.seek(position)
+                data = f.read(min(chunkBytes, remaining))
+                if not data:
+                    break
+                pcm = np.frombuffer(data, dtype=np.int16).astype(np.float32) * scale
+                f.seek(position)
+                f.write(np.clip(np.round(pcm), -self.MAX_AMPLITUDE, self.MAX_AMPLITUDE).astype(np.int16).tobytes())
+                position += len(data)
+                remaining -= len(data)